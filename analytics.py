@@ -0,0 +1,124 @@
+import os
+import time
+import random
+import threading
+
+# Per-question answer analytics.
+# Answers are counted in memory and flushed to question_stats in one batched upsert,
+# instead of one DB write per answer.
+
+MIN_ATTEMPTS = int(os.getenv('ANALYTICS_MIN_ATTEMPTS', 10))  # below this a question counts as "unknown" difficulty
+EASY_RATE = 0.7
+HARD_RATE = 0.4
+STATS_CACHE_TTL_SECONDS = int(os.getenv('ANALYTICS_STATS_TTL', 60)) # balanced picks read a cached snapshot
+
+# question_id -> [attempts, correct, eliminations, timed_answers, total_answer_ms]
+_pending = {}
+_lock = threading.Lock()
+
+_stats = {'by_id': None, 'loaded_at': 0} # question_id -> {'attempts', 'correct'}
+
+def record_answer(question_id, correct, answer_ms=None, eliminated=False):
+    if question_id is None:
+        return
+    with _lock:
+        c = _pending.get(question_id)
+        if c is None:
+            c = _pending[question_id] = [0, 0, 0, 0, 0]
+        c[0] += 1
+        if correct:
+            c[1] += 1
+        if eliminated:
+            c[2] += 1
+        if answer_ms is not None:
+            c[3] += 1
+            c[4] += int(answer_ms)
+
+def _merge_back(batch):
+    with _lock:
+        for question_id, counts in batch.items():
+            c = _pending.setdefault(question_id, [0, 0, 0, 0, 0])
+            for i, v in enumerate(counts):
+                c[i] += v
+
+def flush(conn):
+    global _pending
+    with _lock:
+        batch, _pending = _pending, {}
+    if not batch:
+        return 0
+
+    rows = [(qid, *counts) for qid, counts in batch.items()]
+    cursor = conn.cursor()
+    try:
+        cursor.executemany("""
+            INSERT INTO question_stats (question_id, attempts, correct, eliminations, timed_answers, total_answer_ms)
+            VALUES (%s, %s, %s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE
+                attempts = attempts + VALUES(attempts),
+                correct = correct + VALUES(correct),
+                eliminations = eliminations + VALUES(eliminations),
+                timed_answers = timed_answers + VALUES(timed_answers),
+                total_answer_ms = total_answer_ms + VALUES(total_answer_ms)
+        """, rows)
+        conn.commit()
+    except Exception:
+        # Keep the counts for the next flush
+        _merge_back(batch)
+        raise
+    finally:
+        cursor.close()
+    return len(rows)
+
+def difficulty(stats):
+    # stats: row with 'attempts' and 'correct' (may be None for never-answered questions)
+    attempts = (stats or {}).get('attempts') or 0
+    if attempts < MIN_ATTEMPTS:
+        return 'unknown'
+    rate = (stats.get('correct') or 0) / attempts
+    if rate >= EASY_RATE:
+        return 'easy'
+    if rate < HARD_RATE:
+        return 'hard'
+    return 'medium'
+
+def cached_stats(get_connection):
+    # Snapshot of question_stats, reloaded every STATS_CACHE_TTL_SECONDS; the last good
+    # snapshot (or {}) is kept if the DB is unreachable
+    if _stats['by_id'] is not None and time.time() - _stats['loaded_at'] < STATS_CACHE_TTL_SECONDS:
+        return _stats['by_id']
+    conn = get_connection()
+    if not conn:
+        return _stats['by_id'] or {}
+    try:
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute("SELECT question_id, attempts, correct FROM question_stats")
+        _stats['by_id'] = {row['question_id']: row for row in cursor.fetchall()}
+        _stats['loaded_at'] = time.time()
+        cursor.close()
+    except Exception as err:
+        print(f"Error: {err}")
+    finally:
+        conn.close()
+    return _stats['by_id'] or {}
+
+def pick_balanced(questions, limit, stats):
+    # questions: bank rows; stats: question_id -> {'attempts', 'correct'} (see cached_stats).
+    # Take easy/medium/hard round-robin, unknown questions fill in as medium,
+    # then order the set from easy to hard so the game ramps up.
+    buckets = {'easy': [], 'medium': [], 'hard': []}
+    for q in questions:
+        level = difficulty(stats.get(q['id']))
+        buckets['medium' if level == 'unknown' else level].append(q)
+    for bucket in buckets.values():
+        random.shuffle(bucket)
+
+    picked = {'easy': [], 'medium': [], 'hard': []}
+    total = 0
+    while total < limit and any(buckets.values()):
+        for level in ('easy', 'medium', 'hard'):
+            if buckets[level] and total < limit:
+                picked[level].append(buckets[level].pop())
+                total += 1
+
+    return picked['easy'] + picked['medium'] + picked['hard']
@@ -1,17 +1,35 @@
-from flask import Flask, render_template, request, jsonify, session, redirect
+from flask import Flask, Blueprint, current_app, request, jsonify, session, redirect
+from werkzeug.middleware.proxy_fix import ProxyFix
 import mysql.connector
 import random
 import os
 import string
+import time
+import secrets
+import json
 from dotenv import load_dotenv
+import rollup
+import analytics
+import battle_journal
+import question_bank
+import students
+import quiz_sessions
+import static_pages
+import rate_limit
+import seen_sets
+import live_leaderboard
 from flask_socketio import SocketIO, emit, join_room as join_room_socket, leave_room as leave_room_socket
 
 # Load environment variables
 load_dotenv()
 
-app = Flask(__name__)
-app.secret_key = os.getenv('SECRET_KEY', 'rung_chuong_vang_secret_key') # Needed for session
-socketio = SocketIO(app, cors_allowed_origins="*")
+# Routes live on a blueprint and the app is built by create_app(), so gunicorn --preload
+# can build + warm it once in the master and share it copy-on-write with the workers:
+#   gunicorn --preload "app:create_app()"
+bp = Blueprint('main', __name__)
+socketio = SocketIO(cors_allowed_origins="*")
+
+startup_state = {'ready': False, 'jobs_pid': None, 'questions': 0}
 
 # Cấu hình kết nối MySQL
 db_config = {
@@ -22,6 +40,27 @@ db_config = {
     'port': os.getenv('DB_PORT', 3306)
 }
 
+# Rollup job: aggregates old exam_results rows into daily tables and archives them (see rollup.py)
+ROLLUP_INTERVAL_SECONDS = int(os.getenv('ROLLUP_INTERVAL_SECONDS', 3600))
+ROLLUP_ENABLED = os.getenv('ROLLUP_ENABLED', '1') == '1'
+
+# Per-question answer counters are kept in memory and flushed in batches (see analytics.py)
+ANALYTICS_FLUSH_SECONDS = int(os.getenv('ANALYTICS_FLUSH_SECONDS', 10))
+
+# Battle rooms are journaled asynchronously so players can resume and workers can restart (see battle_journal.py)
+JOURNAL_FLUSH_SECONDS = float(os.getenv('JOURNAL_FLUSH_SECONDS', 1))
+JOURNAL_ENABLED = os.getenv('JOURNAL_ENABLED', '1') == '1'
+
+BULK_APPROVE_MAX = 500 # Max pending_changes per bulk approve/reject batch
+
+QUIZ_LENGTH = 20 # Questions per play-mode quiz
+
+# Repeat logins answered from the identity cache are counted and written in batches (see students.py)
+LOGIN_FLUSH_SECONDS = int(os.getenv('LOGIN_FLUSH_SECONDS', 10))
+
+# Per-student seen-question sets are written back in batches (see seen_sets.py)
+SEEN_FLUSH_SECONDS = int(os.getenv('SEEN_FLUSH_SECONDS', 30))
+
 # --- In-Memory Game State ---
 rooms = {} 
 # Structure:
@@ -32,9 +71,13 @@ rooms = {}
 #       'players': { 'sid': { 'name': '...', 'score': 0, 'answered': False } },
 #       'questions': [ { ... } ],
 #       'current_q_index': 0,
-#       'category': '...'
+#       'category': '...',
+#       'tokens': { 'reconnect_token': 'sid' },
+#       'sid_tokens': { 'sid': 'reconnect_token' },
+#       'student_ids': { student_id, ... } # logged-in players, for no-repeat sampling
 #   }
 # }
+reconnect_tokens = {} # reconnect_token -> room code, for O(1) resume
 
 def get_db_connection():
     try:
@@ -44,29 +87,111 @@ def get_db_connection():
         print(f"Error: {err}")
         return None
 
-@app.route('/')
+# --- App Factory / Startup ---
+
+def create_app():
+    app = Flask(__name__)
+    app.secret_key = os.getenv('SECRET_KEY', 'rung_chuong_vang_secret_key') # Needed for session
+    # Number of reverse proxies in front of the app; only then is X-Forwarded-For trusted
+    trusted_proxies = int(os.getenv('TRUSTED_PROXY_COUNT', 0))
+    if trusted_proxies:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=trusted_proxies)
+    app.register_blueprint(bp)
+    socketio.init_app(app)
+    warm_up(app)
+    return app
+
+def warm_up(app):
+    # Load everything the first requests would otherwise load lazily, before we accept traffic
+    started = time.time()
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name) # parse + compile once, kept in the Jinja cache
+    
+    static_pages.build(app)
+    
+    bank = question_bank.get(get_db_connection)
+    startup_state['questions'] = len(bank['all']) if bank else 0
+    
+    # Battle rooms are NOT restored here: under --preload this runs once in the master, and a
+    # recycled worker would fork from boot-time rooms/journal seqs (see start_background_jobs)
+    startup_state['ready'] = bank is not None
+    print(f"Warm-up done in {(time.time() - started) * 1000:.0f} ms ({startup_state['questions']} questions)")
+
+def start_background_jobs():
+    # Threads don't survive fork, so with --preload each worker starts its own on its first request.
+    # Per-worker mutable state (battle rooms, journal seqs) is also rebuilt here, after fork.
+    if startup_state['jobs_pid'] == os.getpid():
+        return
+    startup_state['jobs_pid'] = os.getpid()
+    if JOURNAL_ENABLED:
+        restore_rooms()
+    if ROLLUP_ENABLED:
+        socketio.start_background_task(rollup_worker)
+    socketio.start_background_task(analytics_flush_worker)
+    socketio.start_background_task(seen_flush_worker)
+    socketio.start_background_task(login_flush_worker)
+    socketio.start_background_task(leaderboard_push_worker)
+    if JOURNAL_ENABLED:
+        socketio.start_background_task(journal_flush_worker)
+
+@bp.before_app_request
+def ensure_background_jobs():
+    start_background_jobs()
+
+@bp.route('/healthz')
+def healthz():
+    return jsonify({'status': 'ok'})
+
+@bp.route('/healthz/ready')
+def readiness():
+    if not startup_state['ready']:
+        # Retry warming the question bank (e.g. DB was down at startup)
+        bank = question_bank.get(get_db_connection)
+        startup_state['ready'] = bank is not None
+        startup_state['questions'] = len(bank['all']) if bank else 0
+    status = 200 if startup_state['ready'] else 503
+    return jsonify({'ready': startup_state['ready'], 'questions': startup_state['questions']}), status
+
+def __getattr__(name):
+    # Keep `gunicorn app:app` working: build the app on first access of app.app
+    if name == 'app':
+        globals()['app'] = create_app()
+        return globals()['app']
+    raise AttributeError(name)
+
+# Pages are pre-rendered and pre-compressed at startup (see static_pages.py)
+@bp.route('/')
 def home():
-    return render_template('index.html')
+    return static_pages.serve('index.html')
 
-@app.route('/dashboard')
+@bp.route('/dashboard')
 def dashboard():
-    return render_template('dashboard.html')
+    return static_pages.serve('dashboard.html')
 
-@app.route('/quiz')
+@bp.route('/quiz')
 def quiz():
-    return render_template('quiz.html')
+    return static_pages.serve('quiz.html')
 
-@app.route('/leaderboard')
+@bp.route('/leaderboard')
 def leaderboard_page():
-    return render_template('leaderboard.html')
+    return static_pages.serve('leaderboard.html')
 
-@app.route('/battle')
+@bp.route('/battle')
 def battle_page():
-    return render_template('battle_app.html')
+    return static_pages.serve('battle_app.html')
+
+@bp.route('/assets/<name>')
+def static_asset(name):
+    response = static_pages.serve_asset(name)
+    if response is None:
+        return jsonify({'error': 'Not found'}), 404
+    return response
 
 # --- API Endpoints ---
 
-@app.route('/api/categories', methods=['GET'])
+@bp.route('/api/categories', methods=['GET'])
+@rate_limit.limit('categories')
+@rate_limit.db_admission
 def get_categories():
     conn = get_db_connection()
     if not conn:
@@ -80,7 +205,9 @@ def get_categories():
     conn.close()
     return jsonify(categories)
 
-@app.route('/api/login', methods=['POST'])
+@bp.route('/api/login', methods=['POST'])
+@rate_limit.limit('login')
+@rate_limit.db_admission
 def login():
     data = request.json
     name = data.get('name')
@@ -89,107 +216,247 @@ def login():
     if not name or not group:
         return jsonify({'error': 'Missing name or class'}), 400
 
-    conn = get_db_connection()
-    if not conn:
-        return jsonify({'error': 'Database connection failed'}), 500
+    name_key, class_key = students.normalize_key(name), students.normalize_key(group)
+    if not name_key or not class_key:
+        return jsonify({'error': 'Missing name or class'}), 400
 
-    cursor = conn.cursor()
-    # Log student login
-    query = "INSERT INTO students (full_name, class_name) VALUES (%s, %s)"
-    cursor.execute(query, (name, group))
-    conn.commit()
-    
-    cursor.close()
-    conn.close()
-    return jsonify({'message': 'Login successful'})
+    # Repeat logins are served from the identity cache; their login count is written in batches
+    identity = students.cached_identity(name_key, class_key)
+    if identity is not None:
+        students.record_login(identity[0])
+    else:
+        conn = get_db_connection()
+        if not conn:
+            return jsonify({'error': 'Database connection failed'}), 500
+
+        cursor = conn.cursor()
+        identity = students.upsert_student(cursor, name, group)
+        conn.commit()
+        
+        cursor.close()
+        conn.close()
+        students.cache_identity(name_key, class_key, identity)
+
+    # Sign the stored spelling, not this login's, so results group under one name
+    student_id, name, group = identity
+    token = students.make_token(current_app.secret_key, student_id, name, group)
+    return jsonify({'message': 'Login successful', 'student_id': student_id, 'token': token, 'name': name, 'group': group})
 
 
-@app.route('/api/questions', methods=['GET'])
+@bp.route('/api/questions', methods=['GET'])
+@rate_limit.limit('questions')
+@rate_limit.db_admission
 def get_questions():
     category = request.args.get('category')
     mode = request.args.get('mode') # 'play' or 'review'
     
-    conn = get_db_connection()
-    if not conn:
+    # Sample from the cached bank instead of ORDER BY RAND() on every request
+    bank = question_bank.get(get_db_connection)
+    if bank is None:
         return jsonify({'error': 'Database connection failed'}), 500
     
-    cursor = conn.cursor(dictionary=True)
-    
-    limit_clause = "LIMIT 20"
+    pool = bank['by_category'].get(category, []) if category else bank['all']
     if mode == 'review':
-        limit_clause = "" # No limit for review
+        questions = random.sample(pool, len(pool)) # No limit for review
+    elif request.args.get('balanced'):
+        # Difficulty-balanced set based on the answer analytics
+        questions = pick_balanced_questions(pool, 20)
+    else:
+        questions = random.sample(pool, min(20, len(pool)))
+    return jsonify(questions)
 
-    if category:
-        query = f"SELECT * FROM questions WHERE category = %s ORDER BY RAND() {limit_clause}"
-        cursor.execute(query, (category,))
+# --- Server-side quiz sessions (play mode) ---
+
+@bp.route('/api/quiz/start', methods=['POST'])
+@rate_limit.limit('quiz_start')
+@rate_limit.db_admission
+def quiz_start():
+    data = request.json or {}
+    category = data.get('category')
+    
+    identity = students.read_token(current_app.secret_key, data.get('token'))
+    if identity:
+        student = (identity['id'], identity['name'], identity['group'])
     else:
-        query = f"SELECT * FROM questions ORDER BY RAND() {limit_clause}"
-        cursor.execute(query)
-        
-    questions = cursor.fetchall()
+        student = (None, data.get('name'), data.get('group'))
+    if not student[1] or not student[2]:
+        return jsonify({'error': 'Missing name or class'}), 400
     
-    cursor.close()
-    conn.close()
-    return jsonify(questions)
+    bank = question_bank.get(get_db_connection)
+    if bank is None:
+        return jsonify({'error': 'Database connection failed'}), 500
+    
+    pool = bank['by_category'].get(category, []) if category else bank['all']
+    if data.get('balanced'):
+        picked = pick_balanced_questions(pool, QUIZ_LENGTH, [student[0]])
+    else:
+        picked = pick_unseen(pool, QUIZ_LENGTH, [student[0]])
+    if not picked:
+        return jsonify({'error': 'No questions'}), 404
+    
+    session_id, quiz = quiz_sessions.create([q['id'] for q in picked], student)
+    return jsonify({
+        'session_id': session_id,
+        'total': len(picked),
+        'question': quiz_sessions.public_question(picked[0], 0),
+        'next': quiz_sessions.public_question(picked[1], 1) if len(picked) > 1 else None # prefetched
+    })
 
-@app.route('/api/submit', methods=['POST'])
-def submit_result():
-    data = request.json
-    name = data.get('name')
-    group = data.get('group') # Lớp
-    score = data.get('score')
-    time_spent = data.get('time_spent')
+@bp.route('/api/quiz/answer', methods=['POST'])
+@rate_limit.limit('quiz_answer')
+@rate_limit.db_admission
+def quiz_answer():
+    data = request.json or {}
+    session_id = data.get('session_id')
+    
+    quiz, error = quiz_sessions.claim(session_id, data.get('index'))
+    if error == 'expired':
+        return jsonify({'error': 'Session expired'}), 404
+    if error == 'finished':
+        return jsonify({'error': 'Session finished'}), 409
+    if error == 'out_of_order':
+        # Double submit / stale tab: tell the client where the session is
+        return jsonify({'error': 'Out of order', 'index': quiz.cursor}), 409
+    if error == 'busy':
+        # The same answer is still being graded/saved by another request; retry after it
+        return jsonify({'error': 'Busy', 'index': quiz.cursor}), 409
+    try:
+        return answer_quiz_question(quiz, session_id, data)
+    finally:
+        quiz_sessions.release(quiz)
+
+def answer_quiz_question(quiz, session_id, data):
+    answer = data.get('answer') # None on timeout
+    bank = question_bank.get(get_db_connection)
+    if bank is None:
+        return jsonify({'error': 'Database connection failed'}), 500
     
-    if not name or not group:
-         return jsonify({'error': 'Missing name or class'}), 400
+    now = time.time()
+    q = bank['by_id'].get(quiz.question_ids[quiz.cursor])
+    if q is None:
+        # Question was deleted mid-session: skip it, no penalty and no points
+        is_correct, correct_answer = True, ''
+    else:
+        is_correct = question_bank.grade(question_bank.grader_for(q), answer if isinstance(answer, str) else None)
+        correct_answer = q['answer']
+    # Answer time is counted from when the client showed the question, which the server can't
+    # see (the client holds the prefetched question during the previous answer's feedback).
+    # Its time_ms is trusted only within the window since the previous answer.
+    answer_window_ms = int((now - quiz.asked_at) * 1000)
+    time_ms = data.get('time_ms')
+    answer_ms = min(int(time_ms), answer_window_ms) if isinstance(time_ms, (int, float)) and time_ms >= 0 else answer_window_ms
+    score = quiz.score + (10 if is_correct and q is not None else 0)
+    
+    # Play mode: a wrong answer ends the game.
+    # The result is saved before the session moves on, so a failed save can be retried as-is.
+    finished = quiz.cursor + 1 >= len(quiz.question_ids) or not is_correct
+    if finished:
+        if not save_quiz_result(quiz, score, now):
+            return jsonify({'error': 'Database connection failed'}), 500
+        quiz_sessions.discard(session_id)
+    
+    if q is not None:
+        analytics.record_answer(q['id'], is_correct, answer_ms)
+        if quiz.student[0]:
+            seen_sets.mark(quiz.student[0], [q['id']])
+    quiz.cursor += 1
+    quiz.asked_at = now
+    quiz.score = score
+    
+    next_question = None
+    if not finished and quiz.cursor + 1 < len(quiz.question_ids):
+        # Prefetch the question after the one the client already holds
+        next_question = quiz_sessions.public_question(
+            bank['by_id'].get(quiz.question_ids[quiz.cursor + 1]), quiz.cursor + 1
+        )
+    
+    return jsonify({
+        'correct': is_correct,
+        'correct_answer': correct_answer,
+        'skipped': q is None,
+        'score': quiz.score,
+        'finished': finished,
+        'next': next_question
+    })
 
+def save_quiz_result(quiz, score, now):
     conn = get_db_connection()
     if not conn:
-        return jsonify({'error': 'Database connection failed'}), 500
-        
+        return False
+    student_id, name, group = quiz.student
     cursor = conn.cursor()
-    query = "INSERT INTO exam_results (student_name, class_name, score, total_time) VALUES (%s, %s, %s, %s)"
-    cursor.execute(query, (name, group, score, time_spent))
-    conn.commit()
-    
-    cursor.close()
-    conn.close()
-    return jsonify({'message': 'Result saved successfully'})
+    try:
+        cursor.execute(
+            "INSERT INTO exam_results (student_name, class_name, student_id, score, total_time) VALUES (%s, %s, %s, %s, %s)",
+            (name, group, student_id, score, int(now - quiz.started_at))
+        )
+        conn.commit()
+    except mysql.connector.Error as err:
+        print(f"Error: {err}")
+        return False
+    finally:
+        cursor.close()
+        conn.close()
+    live_leaderboard.mark_dirty()
+    return True
 
-@app.route('/api/leaderboard', methods=['GET'])
+@bp.route('/api/leaderboard', methods=['GET'])
+@rate_limit.limit('leaderboard')
+@rate_limit.db_admission
 def get_leaderboard():
     conn = get_db_connection()
     if not conn:
         return jsonify({'error': 'Database connection failed'}), 500
         
     cursor = conn.cursor(dictionary=True)
+    results = query_leaderboard(cursor, 10)
+    
+    cursor.close()
+    conn.close()
+    return jsonify(results)
+
+def query_leaderboard(cursor, limit):
     # Order by Score DESC, then Time ASC, but group by student to show only best result
+    # Rolled-up days come from student_best_stats, only the not-yet-rolled-up tail is read raw.
+    # Students without new results rank by their stored best, so the top `limit` rows of the
+    # rank index cover them; students in the tail are merged with their stored best by key.
+    watermark = rollup.get_watermark(cursor)
     query = """
         SELECT student_name, class_name, MAX(score) as score, MIN(total_time) as total_time, MAX(created_at) as created_at
-        FROM exam_results 
+        FROM (
+            (SELECT student_name, class_name, best_score AS score, best_time AS total_time, last_at AS created_at
+             FROM student_best_stats
+             ORDER BY best_score DESC, best_time ASC
+             LIMIT %s)
+            UNION ALL
+            SELECT b.student_name, b.class_name, b.best_score, b.best_time, b.last_at
+            FROM student_best_stats b
+            JOIN (SELECT DISTINCT student_name, class_name FROM exam_results WHERE created_at >= %s) r
+              ON r.student_name = b.student_name AND r.class_name = b.class_name
+            UNION ALL
+            SELECT student_name, class_name, score, total_time, created_at
+            FROM exam_results
+            WHERE created_at >= %s
+        ) t
         GROUP BY student_name, class_name 
         ORDER BY score DESC, total_time ASC 
-        LIMIT 10
+        LIMIT %s
     """
-    cursor.execute(query)
-    results = cursor.fetchall()
-    
-    cursor.close()
-    conn.close()
-    return jsonify(results)
+    cursor.execute(query, (limit, watermark, watermark, limit))
+    return cursor.fetchall()
 
-@app.route('/admin/login')
+@bp.route('/admin/login')
 def admin_login_page():
-    return render_template('admin_login.html')
+    return static_pages.serve('admin_login.html')
 
-@app.route('/admin/dashboard')
+@bp.route('/admin/dashboard')
 def admin_dashboard():
     # Simple session check (In prod, use a proper decorator)
     if 'admin_id' not in session:
         return redirect('/admin/login')
-    return render_template('admin_dashboard.html', role=session.get('role'))
+    return static_pages.serve('admin_dashboard.html', role=session.get('role'))
 
-@app.route('/api/admin/auth', methods=['POST'])
+@bp.route('/api/admin/auth', methods=['POST'])
 def admin_auth():
     data = request.json
     email = data.get('email')
@@ -223,76 +490,198 @@ def admin_auth():
     
     return jsonify({'message': 'Logged in', 'role': role})
 
-@app.route('/api/admin/pending', methods=['GET'])
+@bp.route('/api/admin/pending', methods=['GET'])
 def get_pending_changes():
     if 'admin_id' not in session: return jsonify({'error': 'Unauthorized'}), 401
     
+    # Keyset pagination: newest first, pass the last id seen as ?before_id=
+    before_id = request.args.get('before_id', type=int)
+    limit = max(1, min(request.args.get('limit', 50, type=int), 500))
+    
     conn = get_db_connection()
     cursor = conn.cursor(dictionary=True)
-    cursor.execute("""
+    query = """
         SELECT p.*, a.email as admin_email 
         FROM pending_changes p 
         JOIN admins a ON p.admin_id = a.id 
         WHERE p.status = 'PENDING'
-        ORDER BY p.created_at DESC
-    """)
+    """
+    params = []
+    if before_id:
+        query += " AND p.id < %s"
+        params.append(before_id)
+    query += " ORDER BY p.id DESC LIMIT %s"
+    params.append(limit)
+    cursor.execute(query, params)
     changes = cursor.fetchall()
     cursor.close()
     conn.close()
     return jsonify(changes)
 
-@app.route('/api/admin/approve', methods=['POST'])
+@bp.route('/api/admin/approve', methods=['POST'])
 def approve_change():
     if 'admin_id' not in session or session.get('role') != 'super_admin':
         return jsonify({'error': 'Unauthorized'}), 403
         
     data = request.json
     change_id = data.get('change_id')
-    action = data.get('action') # 'APPORVE' or 'REJECT'
+    action = data.get('action') # 'APPROVE' or 'REJECT'
     
     conn = get_db_connection()
+    if not conn:
+        return jsonify({'error': 'Database connection failed'}), 500
     cursor = conn.cursor(dictionary=True)
     
-    cursor.execute("SELECT * FROM pending_changes WHERE id = %s", (change_id,))
-    change = cursor.fetchone()
+    try:
+        cursor.execute("SELECT * FROM pending_changes WHERE id = %s", (change_id,))
+        change = cursor.fetchone()
+        
+        if not change:
+            return jsonify({'error': 'Change not found'}), 404
+            
+        if action == 'REJECT':
+            cursor.execute("UPDATE pending_changes SET status = 'REJECTED' WHERE id = %s", (change_id,))
+            conn.commit()
+        elif action == 'APPROVE':
+            apply_changes(cursor, [change])
+            conn.commit()
+            question_bank.invalidate()
+    except (mysql.connector.Error, ValueError, KeyError) as err:
+        conn.rollback()
+        return jsonify({'error': f'Change could not be applied: {err}'}), 400
+    finally:
+        cursor.close()
+        conn.close()
+    return jsonify({'message': 'Processed', 'cache_ttl_seconds': question_bank.CACHE_TTL_SECONDS})
+
+@bp.route('/api/admin/approve/bulk', methods=['POST'])
+def bulk_approve_changes():
+    if 'admin_id' not in session or session.get('role') != 'super_admin':
+        return jsonify({'error': 'Unauthorized'}), 403
+    
+    data = request.json
+    action = data.get('action') # 'APPROVE' or 'REJECT'
+    change_ids = data.get('change_ids') or []
+    change_filter = data.get('filter') or {} # { admin_id, action_type } instead of explicit ids
+    
+    if action not in ('APPROVE', 'REJECT'):
+        return jsonify({'error': 'Invalid action'}), 400
+    if not isinstance(change_filter, dict):
+        return jsonify({'error': 'Invalid filter'}), 400
+    if not change_ids and not change_filter:
+        return jsonify({'error': 'No changes selected'}), 400
+    try:
+        change_ids = [int(cid) for cid in change_ids]
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Invalid change ids'}), 400
+    if len(change_ids) > BULK_APPROVE_MAX:
+        return jsonify({'error': f'At most {BULK_APPROVE_MAX} changes per batch'}), 400
+    
+    query = "SELECT * FROM pending_changes WHERE status = 'PENDING'"
+    params = []
+    if change_ids:
+        query += f" AND id IN ({', '.join(['%s'] * len(change_ids))})"
+        params += change_ids
+    if change_filter.get('admin_id'):
+        query += " AND admin_id = %s"
+        params.append(change_filter['admin_id'])
+    if change_filter.get('action_type'):
+        query += " AND action_type = %s"
+        params.append(change_filter['action_type'])
+    query += " ORDER BY id LIMIT %s FOR UPDATE"
+    params.append(BULK_APPROVE_MAX)
+    
+    conn = get_db_connection()
+    if not conn:
+        return jsonify({'error': 'Database connection failed'}), 500
+    cursor = conn.cursor(dictionary=True)
     
-    if not change:
-        return jsonify({'error': 'Change not found'}), 404
+    try:
+        conn.start_transaction()
+        cursor.execute(query, params)
+        changes = cursor.fetchall()
+        conflicts = []
         
-    if action == 'REJECT':
-        cursor.execute("UPDATE pending_changes SET status = 'REJECTED' WHERE id = %s", (change_id,))
+        if action == 'APPROVE':
+            # Two UPDATE/DELETE changes for the same question can't both win: leave them PENDING
+            by_question = {}
+            for c in changes:
+                if c['action_type'] in ('UPDATE', 'DELETE') and c['question_id'] is not None:
+                    by_question.setdefault(c['question_id'], []).append(c['id'])
+            conflicts = sorted(cid for ids in by_question.values() if len(ids) > 1 for cid in ids)
+            conflict_set = set(conflicts)
+            changes = [c for c in changes if c['id'] not in conflict_set]
+            apply_changes(cursor, changes)
+        elif changes:
+            ids = [c['id'] for c in changes]
+            cursor.execute(
+                f"UPDATE pending_changes SET status = 'REJECTED' WHERE id IN ({', '.join(['%s'] * len(ids))})",
+                ids
+            )
         conn.commit()
-    elif action == 'APPROVE':
-        import json
-        content = json.loads(change['new_content_json'])
-        
+    except (mysql.connector.Error, ValueError, KeyError) as err:
+        conn.rollback()
+        return jsonify({'error': f'Batch failed, nothing was applied: {err}'}), 400
+    finally:
+        cursor.close()
+        conn.close()
+    
+    if action == 'APPROVE' and changes:
+        question_bank.invalidate()
+    
+    processed = [c['id'] for c in changes]
+    missing = sorted(set(change_ids) - set(processed) - set(conflicts))
+    return jsonify({
+        'processed': processed,
+        'conflicts': conflicts,
+        'not_found': missing,
+        # Other workers serve their cached question bank until it expires
+        'cache_ttl_seconds': question_bank.CACHE_TTL_SECONDS
+    })
+
+def apply_changes(cursor, changes):
+    # Apply approved pending_changes grouped by action type (one executemany per type).
+    # Every change is parsed before the first write; a bad one raises ValueError.
+    creates, updates, deletes = [], [], []
+    for change in changes:
+        if change['action_type'] == 'DELETE':
+            deletes.append((change['question_id'],))
+            continue
+        content = json.loads(change['new_content_json'] or 'null')
+        if not isinstance(content, dict):
+            raise ValueError(f"change #{change['id']} has no question content")
+        row = (content['category'], content['content'], content.get('options', ''), content['answer'], content['type'])
         if change['action_type'] == 'CREATE':
-             cursor.execute(
-                 "INSERT INTO questions (category, content, options, answer, type) VALUES (%s, %s, %s, %s, %s)",
-                 (content['category'], content['content'], content.get('options', ''), content['answer'], content['type'])
-             )
+            creates.append(row)
         elif change['action_type'] == 'UPDATE':
-             cursor.execute(
-                 "UPDATE questions SET category=%s, content=%s, options=%s, answer=%s, type=%s WHERE id=%s",
-                 (content['category'], content['content'], content.get('options', ''), content['answer'], content['type'], change['question_id'])
-             )
-        elif change['action_type'] == 'DELETE':
-             cursor.execute("DELETE FROM questions WHERE id = %s", (change['question_id'],))
-             
-        cursor.execute("UPDATE pending_changes SET status = 'APPROVED' WHERE id = %s", (change_id,))
-        conn.commit()
-        
-    cursor.close()
-    conn.close()
-    return jsonify({'message': 'Processed'})
+            updates.append(row + (change['question_id'],))
+    
+    if creates:
+        cursor.executemany(
+            "INSERT INTO questions (category, content, options, answer, type) VALUES (%s, %s, %s, %s, %s)",
+            creates
+        )
+    if updates:
+        cursor.executemany(
+            "UPDATE questions SET category=%s, content=%s, options=%s, answer=%s, type=%s WHERE id=%s",
+            updates
+        )
+    if deletes:
+        cursor.executemany("DELETE FROM questions WHERE id = %s", deletes)
+    if changes:
+        ids = [c['id'] for c in changes]
+        cursor.execute(
+            f"UPDATE pending_changes SET status = 'APPROVED' WHERE id IN ({', '.join(['%s'] * len(ids))})",
+            ids
+        )
 
-@app.route('/api/admin/logout', methods=['POST'])
+@bp.route('/api/admin/logout', methods=['POST'])
 def admin_logout():
     session.pop('admin_id', None)
     session.pop('role', None)
     return jsonify({'message': 'Logged out'})
 
-@app.route('/api/admin/questions/create', methods=['POST'])
+@bp.route('/api/admin/questions/create', methods=['POST'])
 def admin_create_questions():
     if 'admin_id' not in session: 
         return jsonify({'error': 'Unauthorized'}), 401
@@ -326,19 +715,21 @@ def admin_create_questions():
     cursor.executemany(sql, vals)
     conn.commit()
     inserted = cursor.rowcount
+    question_bank.invalidate()
     
     cursor.close()
     conn.close()
     
     return jsonify({'message': f'Successfully inserted {inserted} questions'})
 
-@app.route('/api/admin/stats', methods=['GET'])
+@bp.route('/api/admin/stats', methods=['GET'])
 def admin_get_stats():
     if 'admin_id' not in session: return jsonify({'error': 'Unauthorized'}), 401
     
     conn = get_db_connection()
     cursor = conn.cursor()
     
+    # One row per student since the identity model
     cursor.execute("SELECT COUNT(*) FROM students")
     total_students = cursor.fetchone()[0]
     
@@ -356,20 +747,98 @@ def admin_get_stats():
         'active_rooms': active_rooms
     })
 
-@app.route('/api/admin/users', methods=['GET'])
+@bp.route('/api/admin/question-stats', methods=['GET'])
+def admin_question_stats():
+    if 'admin_id' not in session: return jsonify({'error': 'Unauthorized'}), 401
+    
+    category = request.args.get('category')
+    min_attempts = request.args.get('min_attempts', 0, type=int)
+    
+    conn = get_db_connection()
+    if not conn:
+        return jsonify({'error': 'Database connection failed'}), 500
+    
+    cursor = conn.cursor(dictionary=True)
+    query = """
+        SELECT q.id, q.category, q.content, q.type,
+               COALESCE(s.attempts, 0) as attempts,
+               COALESCE(s.correct, 0) as correct,
+               COALESCE(s.eliminations, 0) as eliminations,
+               s.correct / NULLIF(s.attempts, 0) as correct_rate,
+               s.eliminations / NULLIF(s.attempts, 0) as elimination_rate,
+               s.total_answer_ms / NULLIF(s.timed_answers, 0) as avg_answer_ms
+        FROM questions q
+        LEFT JOIN question_stats s ON s.question_id = q.id
+        WHERE COALESCE(s.attempts, 0) >= %s
+    """
+    params = [min_attempts]
+    if category:
+        query += " AND q.category = %s"
+        params.append(category)
+    query += " ORDER BY correct_rate IS NULL, correct_rate ASC"
+    
+    cursor.execute(query, params)
+    stats = cursor.fetchall()
+    cursor.close()
+    conn.close()
+    
+    for row in stats:
+        row['difficulty'] = analytics.difficulty(row)
+        for key in ('correct_rate', 'elimination_rate', 'avg_answer_ms'):
+            if row[key] is not None:
+                row[key] = float(row[key])
+    
+    return jsonify(stats)
+
+@bp.route('/api/admin/users', methods=['GET'])
 def admin_get_users():
     if 'admin_id' not in session: return jsonify({'error': 'Unauthorized'}), 401
     
+    # Students, newest first; keyset pagination with ?before_id=
+    before_id = request.args.get('before_id', type=int)
+    limit = max(1, min(request.args.get('limit', 100, type=int), 500))
+    
     conn = get_db_connection()
     cursor = conn.cursor(dictionary=True)
-    cursor.execute("SELECT * FROM students ORDER BY login_time DESC LIMIT 100") # Limit for perf
+    if before_id:
+        cursor.execute("SELECT * FROM students WHERE id < %s ORDER BY id DESC LIMIT %s", (before_id, limit))
+    else:
+        cursor.execute("SELECT * FROM students ORDER BY id DESC LIMIT %s", (limit,))
     users = cursor.fetchall()
     cursor.close()
     conn.close()
     
     return jsonify(users)
 
-@app.route('/api/admin/users/<int:user_id>', methods=['DELETE'])
+@bp.route('/api/admin/students', methods=['GET'])
+def admin_student_directory():
+    if 'admin_id' not in session: return jsonify({'error': 'Unauthorized'}), 401
+    
+    # One row per student with login count; prefix search on name/class (accent-insensitive)
+    name = request.args.get('q', '').strip()
+    class_name = request.args.get('class', '').strip()
+    limit = max(1, min(request.args.get('limit', 50, type=int), 200))
+    after = students.decode_cursor(request.args.get('after'))
+    if request.args.get('after') and after is None:
+        return jsonify({'error': 'Invalid cursor'}), 400
+    
+    sql, params, order = students.directory_query(name, class_name, after, limit)
+    
+    conn = get_db_connection()
+    if not conn:
+        return jsonify({'error': 'Database connection failed'}), 500
+    cursor = conn.cursor(dictionary=True)
+    cursor.execute(sql, params)
+    rows = cursor.fetchall()
+    cursor.close()
+    conn.close()
+    
+    next_cursor = None
+    if len(rows) == limit:
+        next_cursor = students.encode_cursor([rows[-1][order[0]], rows[-1][order[1]]])
+    return jsonify({'students': rows, 'next': next_cursor})
+
+@bp.route('/api/admin/users/<int:user_id>', methods=['DELETE'])
 def admin_delete_user(user_id):
     if 'admin_id' not in session: return jsonify({'error': 'Unauthorized'}), 401
     
@@ -377,12 +846,13 @@ def admin_delete_user(user_id):
     cursor = conn.cursor()
     cursor.execute("DELETE FROM students WHERE id = %s", (user_id,))
     conn.commit()
+    students.forget_identity(user_id)
     cursor.close()
     conn.close()
     
     return jsonify({'message': 'User deleted'})
 
-@app.route('/api/admin/rooms', methods=['GET'])
+@bp.route('/api/admin/rooms', methods=['GET'])
 def admin_get_rooms():
     if 'admin_id' not in session: return jsonify({'error': 'Unauthorized'}), 401
     
@@ -399,7 +869,7 @@ def admin_get_rooms():
         
     return jsonify(room_list)
 
-@app.route('/api/admin/rooms/<code>', methods=['DELETE'])
+@bp.route('/api/admin/rooms/<code>', methods=['DELETE'])
 def admin_delete_room(code):
     if 'admin_id' not in session: return jsonify({'error': 'Unauthorized'}), 401
     
@@ -407,6 +877,7 @@ def admin_delete_room(code):
         # Emit event to all players in room that it's closed
         socketio.emit('error', {'message': 'Phòng đã bị Admin đóng!'}, room=code)
         # Maybe force redirect all clients?
+        finish_room(code, rooms[code])
         del rooms[code]
         return jsonify({'message': 'Room closed'})
     
@@ -414,7 +885,7 @@ def admin_delete_room(code):
 
 # --- Direct Question CRUD for Admin ---
 
-@app.route('/api/admin/questions/<int:q_id>', methods=['PUT'])
+@bp.route('/api/admin/questions/<int:q_id>', methods=['PUT'])
 def admin_update_question(q_id):
     if 'admin_id' not in session: return jsonify({'error': 'Unauthorized'}), 401
     
@@ -427,11 +898,12 @@ def admin_update_question(q_id):
         (data['category'], data['content'], data.get('options', ''), data['answer'], data['type'], q_id)
     )
     conn.commit()
+    question_bank.invalidate()
     cursor.close()
     conn.close()
-    return jsonify({'message': 'Question updated'})
+    return jsonify({'message': 'Question updated', 'cache_ttl_seconds': question_bank.CACHE_TTL_SECONDS})
 
-@app.route('/api/admin/questions/<int:q_id>', methods=['DELETE'])
+@bp.route('/api/admin/questions/<int:q_id>', methods=['DELETE'])
 def admin_delete_question(q_id):
     if 'admin_id' not in session: return jsonify({'error': 'Unauthorized'}), 401
     
@@ -439,34 +911,259 @@ def admin_delete_question(q_id):
     cursor = conn.cursor()
     cursor.execute("DELETE FROM questions WHERE id = %s", (q_id,))
     conn.commit()
+    question_bank.invalidate()
     cursor.close()
     conn.close()
-    return jsonify({'message': 'Question deleted'})
+    return jsonify({'message': 'Question deleted', 'cache_ttl_seconds': question_bank.CACHE_TTL_SECONDS})
+
+# --- Question Helpers ---
+
+def pick_balanced_questions(pool, limit, student_ids=()):
+    # Difficulty-balanced set from the cached bank and a cached question_stats snapshot
+    student_ids = [i for i in student_ids if i]
+    if student_ids:
+        # Balance among unseen questions while there are enough of them
+        is_seen = seen_by(student_ids)
+        unseen = [q for q in pool if not is_seen(q['id'])]
+        if len(unseen) >= limit:
+            pool = unseen
+    return analytics.pick_balanced(pool, limit, analytics.cached_stats(get_db_connection))
+
+def is_correct_answer(q, ans):
+    return question_bank.grade(question_bank.grader_for(q), ans)
+
+def seen_by(student_ids):
+    # Seen by anyone in the group (a battle roster, or a single student)
+    sets = seen_sets.get_many(get_db_connection, list(student_ids))
+    return lambda qid: any(qid in s for s in sets)
+
+def pick_unseen(pool, limit, student_ids):
+    # Random sample that avoids questions these students have already been asked
+    student_ids = [i for i in student_ids if i]
+    if not student_ids:
+        return random.sample(pool, min(limit, len(pool)))
+    picked, exhausted = seen_sets.sample_unseen(pool, limit, seen_by(student_ids))
+    if exhausted:
+        # Everything here has been seen: start a new cycle over this pool
+        pool_ids = [q['id'] for q in pool]
+        for student_id in student_ids:
+            seen_sets.start_new_cycle(student_id, pool_ids)
+    return picked
+
+# --- Background Jobs ---
+
+def rollup_worker():
+    while True:
+        socketio.sleep(ROLLUP_INTERVAL_SECONDS)
+        conn = get_db_connection()
+        if not conn:
+            continue
+        try:
+            result = rollup.run_rollup(conn)
+            if result:
+                print(f"Rollup: {result}")
+        except mysql.connector.Error as err:
+            print(f"Rollup error: {err}")
+        finally:
+            conn.close()
+
+def analytics_flush_worker():
+    while True:
+        socketio.sleep(ANALYTICS_FLUSH_SECONDS)
+        conn = get_db_connection()
+        if not conn:
+            continue
+        try:
+            analytics.flush(conn)
+        except mysql.connector.Error as err:
+            print(f"Analytics flush error: {err}")
+        finally:
+            conn.close()
+
+def refresh_leaderboard():
+    # Recompute the live top-N if something changed; -> diff payload or None
+    conn = get_db_connection()
+    if not conn:
+        return None
+    cursor = conn.cursor(dictionary=True)
+    
+    def read_max_id():
+        # Results saved by other workers don't set our dirty flag
+        cursor.execute("SELECT MAX(id) AS max_id FROM exam_results")
+        return cursor.fetchone()['max_id']
+    
+    try:
+        return live_leaderboard.refresh(lambda limit: query_leaderboard(cursor, limit), read_max_id)
+    except mysql.connector.Error as err:
+        print(f"Leaderboard refresh error: {err}")
+        return None
+    finally:
+        cursor.close()
+        conn.close()
+
+def leaderboard_push_worker():
+    # One computation per window, broadcast to every viewer in the room
+    while True:
+        socketio.sleep(live_leaderboard.PUSH_SECONDS)
+        if not live_leaderboard.has_subscribers():
+            continue
+        payload = refresh_leaderboard()
+        if payload:
+            socketio.emit('leaderboard_diff', payload, room=live_leaderboard.ROOM)
+
+def login_flush_worker():
+    while True:
+        socketio.sleep(LOGIN_FLUSH_SECONDS)
+        conn = get_db_connection()
+        if not conn:
+            continue
+        try:
+            students.flush_logins(conn)
+        except mysql.connector.Error as err:
+            print(f"Login flush error: {err}")
+        finally:
+            conn.close()
+
+def seen_flush_worker():
+    while True:
+        socketio.sleep(SEEN_FLUSH_SECONDS)
+        conn = get_db_connection()
+        if not conn:
+            continue
+        try:
+            seen_sets.flush(conn)
+        except mysql.connector.Error as err:
+            print(f"Seen-set flush error: {err}")
+        finally:
+            conn.close()
+
+
+# --- Battle Journal / Reconnect ---
+
+def issue_reconnect_token(room_code, room, sid, name, is_host):
+    token = secrets.token_urlsafe(16)
+    room['tokens'][token] = sid
+    room['sid_tokens'][sid] = token
+    reconnect_tokens[token] = room_code
+    battle_journal.append(room_code, 'join', {'token': token, 'name': name, 'is_host': is_host})
+    # Sent only to this player, never broadcast with the player list
+    emit('session_token', {'token': token, 'room_code': room_code})
+    return token
+
+def public_players(room):
+    # Never the in-progress round's answers (current_answer / answer_ms)
+    return [
+        {'name': p['name'], 'score': p['score'], 'eliminated': p.get('eliminated', False), 'is_host': p.get('is_host', False)}
+        for p in room['players'].values()
+    ]
+
+def finish_room(room_code, room):
+    room['state'] = 'finished'
+    battle_journal.append(room_code, 'finish')
+    battle_journal.snapshot(room_code, room)
+    for token in room.get('tokens', {}):
+        reconnect_tokens.pop(token, None)
+
+def restore_rooms():
+    # Rebuild in-flight rooms after a worker restart: latest snapshot + journal tail
+    conn = get_db_connection()
+    if not conn:
+        return
+    try:
+        restored = battle_journal.load_in_flight(conn)
+        cursor = conn.cursor(dictionary=True)
+        for code, room in restored.items():
+            ids = room.pop('question_ids')
+            if ids:
+                placeholders = ', '.join(['%s'] * len(ids))
+                cursor.execute(f"SELECT * FROM questions WHERE id IN ({placeholders})", ids)
+                by_id = {q['id']: q for q in cursor.fetchall()}
+                if any(i not in by_id for i in ids):
+                    # A question was deleted: current_q_index would point at the wrong one, end the room
+                    room['questions'] = []
+                    finish_room(code, room)
+                    continue
+                room['questions'] = [by_id[i] for i in ids]
+            room['restored'] = True
+            rooms[code] = room
+            for token in room['tokens']:
+                reconnect_tokens[token] = code
+        cursor.close()
+        if restored:
+            print(f"Restored {len(restored)} battle room(s) from journal")
+    except mysql.connector.Error as err:
+        print(f"Journal restore error: {err}")
+    finally:
+        conn.close()
+
+def journal_flush_worker():
+    while True:
+        socketio.sleep(JOURNAL_FLUSH_SECONDS)
+        conn = get_db_connection()
+        if not conn:
+            continue
+        try:
+            battle_journal.flush(conn)
+        except mysql.connector.Error as err:
+            print(f"Journal flush error: {err}")
+        finally:
+            conn.close()
+
 
 # --- SocketIO Events ---
 
+@socketio.on('connect')
+def handle_connect():
+    # Websocket-only workers may never see a plain HTTP request
+    start_background_jobs()
+
+@socketio.on('disconnect')
+def handle_disconnect():
+    live_leaderboard.unsubscribe(request.sid)
+
+@socketio.on('subscribe_leaderboard')
+@rate_limit.limit_event('subscribe_leaderboard')
+def handle_subscribe_leaderboard(data=None):
+    # While there are subscribers the push task keeps the ranking current;
+    # otherwise it may be stale, so the first viewer triggers a refresh
+    if not live_leaderboard.has_subscribers():
+        refresh_leaderboard()
+    join_room_socket(live_leaderboard.ROOM)
+    live_leaderboard.subscribe(request.sid)
+    emit('leaderboard_snapshot', live_leaderboard.snapshot())
+
 @socketio.on('create_room')
+@rate_limit.limit_event('create_room')
 def handle_create_room(data):
     # data: { 'host_name': ..., 'category': ... }
     room_code = ''.join(random.choices(string.ascii_uppercase + string.digits, k=6))
     
     host_name = data.get('host_name')
     category = data.get('category')
+    balanced = bool(data.get('balanced'))
+    identity = students.read_token(current_app.secret_key, data.get('token'))
     
     rooms[room_code] = {
         'host_sid': request.sid,
         'state': 'waiting',
         'players': { request.sid: { 'name': host_name, 'score': 0, 'answered': False, 'is_host': True, 'eliminated': False } },
+        'tokens': {}, # reconnect token -> current sid
+        'sid_tokens': {}, # current sid -> reconnect token
+        'student_ids': {identity['id']} if identity else set(),
         'questions': [], # To be loaded
         'current_q_index': 0,
         'category': category,
+        'balanced': balanced,
         'active_players_count': 1
     }
     
     join_room_socket(room_code)
-    emit('room_created', {'room_code': room_code, 'players': [p for p in rooms[room_code]['players'].values()]}, room=room_code)
+    issue_reconnect_token(room_code, rooms[room_code], request.sid, host_name, True)
+    battle_journal.snapshot(room_code, rooms[room_code])
+    emit('room_created', {'room_code': room_code, 'players': public_players(rooms[room_code])}, room=room_code)
 
 @socketio.on('join_room')
+@rate_limit.limit_event('join_room')
 def handle_join_room(data):
     room_code = data.get('room_code').upper()
     player_name = data.get('player_name')
@@ -483,12 +1180,63 @@ def handle_join_room(data):
     join_room_socket(room_code)
     room['players'][request.sid] = { 'name': player_name, 'score': 0, 'answered': False, 'is_host': False, 'eliminated': False }
     room['active_players_count'] += 1
+    identity = students.read_token(current_app.secret_key, data.get('token'))
+    if identity:
+        room.setdefault('student_ids', set()).add(identity['id'])
+    issue_reconnect_token(room_code, room, request.sid, player_name, False)
     
     # Broadcast list of players
-    player_list = [p for p in room['players'].values()]
-    emit('player_joined', {'players': player_list}, room=room_code)
+    emit('player_joined', {'players': public_players(room)}, room=room_code)
+
+@socketio.on('resume_session')
+@rate_limit.limit_event('resume_session')
+def handle_resume_session(data):
+    # Reconnect after a dropped socket / page reload / worker restart: O(1) token lookup
+    token = data.get('token')
+    room_code = reconnect_tokens.get(token)
+    room = rooms.get(room_code)
+    if not room or token not in room['tokens']:
+        emit('resume_failed', {})
+        return
+    
+    old_sid = room['tokens'][token]
+    if old_sid != request.sid:
+        room['players'][request.sid] = room['players'].pop(old_sid)
+        room['tokens'][token] = request.sid
+        del room['sid_tokens'][old_sid]
+        room['sid_tokens'][request.sid] = token
+        if room['host_sid'] == old_sid:
+            room['host_sid'] = request.sid
+    
+    join_room_socket(room_code)
+    player = room['players'][request.sid]
+    emit('resumed', {
+        'room_code': room_code,
+        'state': room['state'],
+        'is_host': room['host_sid'] == request.sid,
+        'eliminated': player.get('eliminated', False),
+        'players': public_players(room)
+    })
+    
+    if room['state'] != 'playing':
+        return
+    if room.get('round_done'):
+        # The worker that was going to advance this room is gone; let the host pick it up
+        if room.get('restored') and room['host_sid'] == request.sid:
+            room['restored'] = False
+            if room['current_q_index'] >= len(room['questions']) - 1:
+                finish_room(room_code, room)
+                sorted_final = sorted(room['players'].values(), key=lambda x: x['score'], reverse=True)
+                emit('game_over', {'leaderboard': sorted_final, 'reason': 'finished'}, room=room_code)
+            else:
+                room['current_q_index'] += 1
+                send_question(room_code)
+    else:
+        # Replay the current question to this player only
+        emit('new_question', question_payload(room))
 
 @socketio.on('start_game')
+@rate_limit.limit_event('start_game')
 def handle_start_game(data):
     room_code = data.get('room_code')
     room = rooms.get(room_code)
@@ -500,16 +1248,13 @@ def handle_start_game(data):
     category = room['category']
     mode = 'play' 
     
-    conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
-    
     # Battle Mode: Random 10 questions from ALL categories
-    query = "SELECT * FROM questions ORDER BY RAND() LIMIT 10"
-    cursor.execute(query)
-        
-    room['questions'] = cursor.fetchall()
-    cursor.close()
-    conn.close()
+    bank = question_bank.get(get_db_connection)
+    pool = bank['all'] if bank else []
+    if room.get('balanced'):
+        room['questions'] = pick_balanced_questions(pool, 10, room.get('student_ids', ()))
+    else:
+        room['questions'] = pick_unseen(pool, 10, room.get('student_ids', ()))
     
     if not room['questions']:
         emit('error', {'message': 'Không có câu hỏi!'}, room=room_code)
@@ -517,27 +1262,46 @@ def handle_start_game(data):
 
     room['state'] = 'playing'
     room['current_q_index'] = 0
+    battle_journal.append(room_code, 'start', {'question_ids': [q['id'] for q in room['questions']]})
+    battle_journal.snapshot(room_code, room)
     
     # Broadcast first question
     send_question(room_code)
 
+def question_payload(room):
+    idx = room['current_q_index']
+    q = room['questions'][idx]
+    return {
+        'question': q['content'],
+        'options': q['options'],
+        'type': q['type'], # tu_luan or trac_nghiem
+        'index': idx + 1,
+        'total': len(room['questions']),
+        'time_limit': 15,
+        'active_players': sum(1 for p in room['players'].values() if not p.get('eliminated'))
+    }
+
 def send_question(room_code):
     room = rooms[room_code]
     idx = room['current_q_index']
     
     if idx >= len(room['questions']):
         # Game Over: End of questions
-        room['state'] = 'finished'
+        finish_room(room_code, room)
         sorted_final = sorted(room['players'].values(), key=lambda x: x['score'], reverse=True)
         emit('game_over', {'leaderboard': sorted_final, 'reason': 'finished'}, room=room_code)
         return
 
-    q = room['questions'][idx]
-    
     # Reset answer status
     for p in room['players'].values():
         p['answered'] = False
         p['current_answer'] = None
+        p.pop('answer_ms', None)
+    room['question_sent_at'] = time.time()
+    room['round_done'] = False
+    battle_journal.append(room_code, 'question', {'index': idx})
+    for student_id in room.get('student_ids', ()):
+        seen_sets.mark(student_id, [room['questions'][idx]['id']])
 
     # Only count non-eliminated players for answer tracking
     active_count = sum(1 for p in room['players'].values() if not p.get('eliminated'))
@@ -550,17 +1314,10 @@ def send_question(room_code):
         # Check if we should end
         pass # Handle in process_result for consistency
 
-    emit('new_question', {
-        'question': q['content'],
-        'options': q['options'],
-        'type': q['type'], # tu_luan or trac_nghiem
-        'index': idx + 1,
-        'total': len(room['questions']),
-        'time_limit': 15,
-        'active_players': active_count
-    }, room=room_code)
+    emit('new_question', question_payload(room), room=room_code)
 
 @socketio.on('submit_answer')
+@rate_limit.limit_event('submit_answer')
 def handle_answer(data):
     room_code = data.get('room_code')
     answer = data.get('answer')
@@ -574,6 +1331,9 @@ def handle_answer(data):
     
     player['answered'] = True
     player['current_answer'] = answer
+    if room.get('question_sent_at'):
+        player['answer_ms'] = int((time.time() - room['question_sent_at']) * 1000)
+    battle_journal.append(room_code, 'answer', {'token': room['sid_tokens'].get(request.sid), 'answer': answer})
     
     # Notify host/everyone that this user answered (but hide result)
     emit('player_answered', {'sid': request.sid}, room=room_code)
@@ -594,32 +1354,36 @@ def process_round_result(room_code):
     
     # Evaluation
     eliminated_in_this_round = []
+    eliminated_tokens = []
     
-    active_players = [p for p in room['players'].values() if not p.get('eliminated')]
+    active_players = [(sid, p) for sid, p in room['players'].items() if not p.get('eliminated')]
+    # round_timeout can arrive after the round was already processed; count each question once
+    record_stats = room.get('stats_recorded_index') != room['current_q_index']
+    room['stats_recorded_index'] = room['current_q_index']
     
-    for p in active_players:
-        ans = p.get('current_answer', '')
-        is_correct = False
-        
-        if q['type'] == 'tu_luan':
-             if ans.strip().lower() == correct_content.strip().lower():
-                 is_correct = True
-        else:
-             # Multiple choice check
-             choice_prefix = ans.split('.')[0].strip().upper() if ans else ''
-             correct_prefix = correct_content.split('.')[0].strip().upper()
-             if (ans == correct_content) or (choice_prefix == correct_prefix):
-                 is_correct = True
+    for sid, p in active_players:
+        is_correct = is_correct_answer(q, p.get('current_answer'))
+        if record_stats:
+            analytics.record_answer(q.get('id'), is_correct, p.get('answer_ms'), eliminated=not is_correct)
         
         if is_correct:
             p['score'] += 10
         else:
             p['eliminated'] = True
             eliminated_in_this_round.append(p['name'])
+            eliminated_tokens.append(room['sid_tokens'].get(sid))
             
     # Remaining active players
     remaining = [p for p in room['players'].values() if not p.get('eliminated')]
     
+    room['round_done'] = True
+    battle_journal.append(room_code, 'result', {
+        'index': room['current_q_index'],
+        'eliminated': eliminated_tokens,
+        'scores': {room['sid_tokens'].get(sid): p['score'] for sid, p in room['players'].items()}
+    })
+    battle_journal.snapshot(room_code, room)
+    
     # Broadcast Round Result
     emit('round_result', {
         'correct_answer': correct_content,
@@ -631,15 +1395,15 @@ def process_round_result(room_code):
     # Check Game Over Conditions
     if len(remaining) == 1 and len(room['players']) > 1:
         # WINNER (if multiplayer)
-        room['state'] = 'finished'
+        finish_room(room_code, room)
         emit('game_over', {'winner': remaining[0], 'reason': 'last_man'}, room=room_code)
     elif len(remaining) == 0:
         # DRAW (All died same round)
-        room['state'] = 'finished'
+        finish_room(room_code, room)
         emit('game_over', {'reason': 'draw'}, room=room_code)
     elif room['current_q_index'] >= len(room['questions']) - 1:
         # End of questions
-        room['state'] = 'finished'
+        finish_room(room_code, room)
         # Sort by Score
         sorted_final = sorted(room['players'].values(), key=lambda x: x['score'], reverse=True)
         emit('game_over', {'leaderboard': sorted_final, 'reason': 'finished'}, room=room_code)
@@ -652,6 +1416,7 @@ def process_round_result(room_code):
              send_question(room_code)
 
 @socketio.on('round_timeout')
+@rate_limit.limit_event('round_timeout')
 def handle_round_timeout(data):
     # Host tells us time is up, force process round
     room_code = data.get('room_code')
@@ -663,6 +1428,7 @@ def handle_round_timeout(data):
          process_round_result(room_code)
 
 @socketio.on('next_question')
+@rate_limit.limit_event('next_question')
 def handle_next(data):
     room_code = data.get('room_code')
     room = rooms.get(room_code)
@@ -673,4 +1439,5 @@ def handle_next(data):
     
 
 if __name__ == '__main__':
+    app = create_app()
     socketio.run(app, debug=True, host='0.0.0.0', port=5000, allow_unsafe_werkzeug=True)
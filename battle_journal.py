@@ -0,0 +1,212 @@
+import os
+import json
+import time
+from collections import deque
+
+# Append-only per-room battle journal + compact snapshots.
+# Events are queued in memory and written in batches by a background task,
+# so socket handlers never wait on the DB. A restarted worker rebuilds in-flight
+# rooms from the latest snapshot plus the journal tail (events with seq > snapshot seq).
+#
+# Players are identified by their reconnect token in the journal: socket sids change
+# on every reconnect and mean nothing after a restart.
+#
+# The tables stay small: events covered by a flushed snapshot are deleted, finished rooms
+# are dropped entirely, and rooms older than RESTORE_MAX_AGE_SECONDS are swept periodically.
+
+RESTORE_MAX_AGE_SECONDS = int(os.getenv('JOURNAL_RESTORE_MAX_AGE', 2 * 3600))
+# Only rooms with no journal activity for this long are restored: a fresher room is
+# probably still live in a sibling worker
+RESTORE_IDLE_SECONDS = int(os.getenv('JOURNAL_RESTORE_IDLE', 60))
+SWEEP_INTERVAL_SECONDS = 600
+
+_events = deque()    # (room_code, seq, event_type, payload_json)
+_snapshots = {}      # room_code -> (seq, state, snapshot_json), only the latest one matters
+_seqs = {}           # room_code -> last seq handed out
+_last_sweep = [0.0]
+
+def append(room_code, event_type, payload=None):
+    seq = _seqs.get(room_code, 0) + 1
+    _seqs[room_code] = seq
+    _events.append((room_code, seq, event_type, json.dumps(payload or {}, ensure_ascii=False)))
+    return seq
+
+def compact_room(room):
+    # Players are stored by token, so the snapshot survives reconnects/restarts
+    sid_tokens = room['sid_tokens']
+    return {
+        'state': room['state'],
+        'category': room.get('category'),
+        'balanced': room.get('balanced', False),
+        'current_q_index': room['current_q_index'],
+        'round_done': room.get('round_done', False),
+        'question_ids': [q['id'] for q in room['questions']],
+        # [token, name, score, eliminated, is_host]
+        'players': [
+            [sid_tokens.get(sid), p['name'], p['score'], p.get('eliminated', False), p.get('is_host', False)]
+            for sid, p in room['players'].items()
+        ],
+    }
+
+def snapshot(room_code, room):
+    _snapshots[room_code] = (
+        _seqs.get(room_code, 0),
+        room['state'],
+        json.dumps(compact_room(room), ensure_ascii=False)
+    )
+    if room['state'] == 'finished':
+        _seqs.pop(room_code, None)
+
+def flush(conn):
+    global _snapshots
+    events = []
+    while _events:
+        events.append(_events.popleft())
+    snapshots, _snapshots = list(_snapshots.items()), {}
+    sweep = time.time() - _last_sweep[0] >= SWEEP_INTERVAL_SECONDS
+    if not events and not snapshots and not sweep:
+        return 0
+
+    # Events already covered by a snapshot in this batch don't need to be written
+    covered = {code: seq for code, (seq, state, body) in snapshots}
+    finished = [code for code, (seq, state, body) in snapshots if state == 'finished']
+    rows = [e for e in events if e[1] > covered.get(e[0], 0) and e[0] not in finished]
+
+    cursor = conn.cursor()
+    try:
+        if rows:
+            # IGNORE: a room restored on two workers may replay the same seq
+            cursor.executemany(
+                "INSERT IGNORE INTO battle_events (room_code, seq, event_type, payload_json) VALUES (%s, %s, %s, %s)",
+                rows
+            )
+        live = [(code, seq, state, body) for code, (seq, state, body) in snapshots if state != 'finished']
+        if live:
+            cursor.executemany("""
+                INSERT INTO battle_snapshots (room_code, seq, state, snapshot_json) VALUES (%s, %s, %s, %s)
+                ON DUPLICATE KEY UPDATE
+                    seq = VALUES(seq), state = VALUES(state), snapshot_json = VALUES(snapshot_json)
+            """, live)
+            # Compaction: the journal only needs the tail after the latest snapshot
+            cursor.executemany(
+                "DELETE FROM battle_events WHERE room_code = %s AND seq <= %s",
+                [(code, seq) for code, seq, state, body in live]
+            )
+        if finished:
+            # Nothing is restored from a finished room
+            cursor.executemany("DELETE FROM battle_events WHERE room_code = %s", [(code,) for code in finished])
+            cursor.executemany("DELETE FROM battle_snapshots WHERE room_code = %s", [(code,) for code in finished])
+        if sweep:
+            # Abandoned rooms that are too old to restore
+            cursor.execute("DELETE FROM battle_events WHERE created_at < NOW() - INTERVAL %s SECOND", (RESTORE_MAX_AGE_SECONDS,))
+            cursor.execute("DELETE FROM battle_snapshots WHERE updated_at < NOW() - INTERVAL %s SECOND", (RESTORE_MAX_AGE_SECONDS,))
+        conn.commit()
+        if sweep:
+            _last_sweep[0] = time.time()
+    except Exception:
+        # Put everything back for the next flush (newer snapshots win)
+        _events.extendleft(reversed(events))
+        for code, snap in snapshots:
+            _snapshots.setdefault(code, snap)
+        raise
+    finally:
+        cursor.close()
+    return len(events)
+
+def new_room(snap):
+    room = {
+        'host_sid': None,
+        'state': snap['state'],
+        'players': {},
+        'tokens': {},
+        'sid_tokens': {},
+        'questions': [],
+        'question_ids': snap['question_ids'],
+        'current_q_index': snap['current_q_index'],
+        'round_done': snap.get('round_done', False),
+        'category': snap.get('category'),
+        'balanced': snap.get('balanced', False),
+        'active_players_count': 0,
+    }
+    for token, name, score, eliminated, is_host in snap['players']:
+        if token:
+            add_offline_player(room, token, name, is_host, score, eliminated)
+    return room
+
+def add_offline_player(room, token, name, is_host, score=0, eliminated=False):
+    # Placeholder sid until the player resumes with their token
+    sid = 'offline:' + token
+    room['players'][sid] = {'name': name, 'score': score, 'answered': False, 'is_host': is_host, 'eliminated': eliminated}
+    room['tokens'][token] = sid
+    room['sid_tokens'][sid] = token
+    room['active_players_count'] += 1
+    if is_host:
+        room['host_sid'] = sid
+
+def apply_event(room, event_type, payload):
+    players = room['players']
+    tokens = room['tokens']
+    if event_type == 'join':
+        if payload['token'] not in tokens:
+            add_offline_player(room, payload['token'], payload['name'], payload.get('is_host', False))
+    elif event_type == 'start':
+        room['question_ids'] = payload['question_ids']
+        room['state'] = 'playing'
+        room['current_q_index'] = 0
+    elif event_type == 'question':
+        room['current_q_index'] = payload['index']
+        room['round_done'] = False
+        for p in players.values():
+            p['answered'] = False
+            p['current_answer'] = None
+    elif event_type == 'answer':
+        p = players.get(tokens.get(payload['token']))
+        if p:
+            p['answered'] = True
+            p['current_answer'] = payload.get('answer')
+    elif event_type == 'result':
+        room['round_done'] = True
+        for token, score in payload['scores'].items():
+            p = players.get(tokens.get(token))
+            if p:
+                p['score'] = score
+        for token in payload['eliminated']:
+            p = players.get(tokens.get(token))
+            if p:
+                p['eliminated'] = True
+    elif event_type == 'finish':
+        room['state'] = 'finished'
+
+def load_in_flight(conn):
+    # -> {room_code: room}; rooms still need their questions loaded from 'question_ids'
+    cursor = conn.cursor(dictionary=True)
+    # Recent enough to restore, but idle (no snapshot or event) for RESTORE_IDLE_SECONDS.
+    # Times are compared on the DB clock, which wrote them.
+    cursor.execute("""
+        SELECT s.room_code, s.seq, s.snapshot_json
+        FROM battle_snapshots s
+        LEFT JOIN (SELECT room_code, MAX(created_at) AS last_event FROM battle_events GROUP BY room_code) e
+          ON e.room_code = s.room_code
+        WHERE s.state != 'finished'
+          AND s.updated_at >= NOW() - INTERVAL %s SECOND
+          AND GREATEST(s.updated_at, COALESCE(e.last_event, s.updated_at)) < NOW() - INTERVAL %s SECOND
+    """, (RESTORE_MAX_AGE_SECONDS, RESTORE_IDLE_SECONDS))
+    snaps = cursor.fetchall()
+
+    restored = {}
+    for snap in snaps:
+        room = new_room(json.loads(snap['snapshot_json']))
+        last_seq = snap['seq']
+        cursor.execute(
+            "SELECT seq, event_type, payload_json FROM battle_events WHERE room_code = %s AND seq > %s ORDER BY seq",
+            (snap['room_code'], snap['seq'])
+        )
+        for ev in cursor.fetchall():
+            apply_event(room, ev['event_type'], json.loads(ev['payload_json']))
+            last_seq = ev['seq']
+        if room['state'] != 'finished':
+            restored[snap['room_code']] = room
+            _seqs[snap['room_code']] = last_seq
+
+    cursor.close()
+    return restored
@@ -0,0 +1,59 @@
+import sys
+import time
+import argparse
+import statistics
+import subprocess
+import urllib.request
+import urllib.error
+
+# Startup benchmark: time from process start to the first successful /api/questions.
+#   python bench_startup.py                       # gunicorn --preload factory mode
+#   python bench_startup.py --runs 5 --port 8001
+#   python bench_startup.py --cmd "python app.py" --port 5000
+
+def default_cmd(port):
+    return [sys.executable, '-m', 'gunicorn', '--preload', '-b', f'127.0.0.1:{port}', 'app:create_app()']
+
+def measure(cmd, url, timeout):
+    started = time.perf_counter()
+    proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.perf_counter() - started < timeout:
+            if proc.poll() is not None:
+                raise RuntimeError(f"Server exited with code {proc.returncode}")
+            try:
+                with urllib.request.urlopen(url, timeout=1) as res:
+                    if res.status == 200:
+                        return (time.perf_counter() - started) * 1000
+            except (urllib.error.URLError, ConnectionError, TimeoutError):
+                pass
+            time.sleep(0.01)
+        raise RuntimeError(f"No successful response from {url} within {timeout}s")
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure time from process start to first successful /api/questions')
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--cmd', help='Server command (default: gunicorn --preload "app:create_app()")')
+    parser.add_argument('--timeout', type=float, default=60)
+    args = parser.parse_args()
+
+    cmd = args.cmd.split() if args.cmd else default_cmd(args.port)
+    url = f'http://127.0.0.1:{args.port}/api/questions'
+
+    times = []
+    for i in range(args.runs):
+        ms = measure(cmd, url, args.timeout)
+        times.append(ms)
+        print(f"run {i + 1}: {ms:.0f} ms")
+
+    print(f"median: {statistics.median(times):.0f} ms, min: {min(times):.0f} ms, max: {max(times):.0f} ms")
+
+if __name__ == '__main__':
+    main()
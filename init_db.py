@@ -1,5 +1,6 @@
 import mysql.connector
 import os
+from students import normalize_key
 
 def get_db_config():
     return {
@@ -9,6 +10,63 @@ def get_db_config():
         'database': os.getenv('DB_NAME', 'rung_chuong_vang')
     }
 
+def add_index(cursor, table, index_name, columns, unique=False):
+    # MySQL has no CREATE INDEX IF NOT EXISTS, so check information_schema first
+    cursor.execute(
+        "SELECT COUNT(*) FROM information_schema.statistics "
+        "WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s",
+        (table, index_name)
+    )
+    if cursor.fetchone()[0] == 0:
+        cursor.execute(f"CREATE {'UNIQUE ' if unique else ''}INDEX {index_name} ON {table} ({columns})")
+
+def add_column(cursor, table, column, definition):
+    cursor.execute(
+        "SELECT COUNT(*) FROM information_schema.columns "
+        "WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s",
+        (table, column)
+    )
+    if cursor.fetchone()[0] == 0:
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+def backfill_student_keys(conn, cursor, batch_size=5000):
+    # Accent-insensitive search keys are computed in Python (students.normalize_key)
+    last_id = 0
+    while True:
+        cursor.execute(
+            "SELECT id, full_name, class_name FROM students WHERE id > %s AND name_key = '' ORDER BY id LIMIT %s",
+            (last_id, batch_size)
+        )
+        rows = cursor.fetchall()
+        if not rows:
+            break
+        cursor.executemany(
+            "UPDATE students SET name_key = %s, class_key = %s WHERE id = %s",
+            [(normalize_key(name), normalize_key(group), sid) for sid, name, group in rows]
+        )
+        conn.commit()
+        last_id = rows[-1][0]
+
+def merge_duplicate_students(conn, cursor):
+    # Before the identity model every login inserted a row: fold them into the oldest row
+    cursor.execute("""
+        CREATE TEMPORARY TABLE student_merge AS
+        SELECT name_key, class_key, MIN(id) AS keep_id, COUNT(*) AS logins, MAX(login_time) AS last_login
+        FROM students
+        GROUP BY name_key, class_key
+        HAVING COUNT(*) > 1
+    """)
+    cursor.execute("""
+        UPDATE students s JOIN student_merge m ON s.id = m.keep_id
+        SET s.login_count = m.logins, s.login_time = m.last_login
+    """)
+    cursor.execute("""
+        DELETE s FROM students s JOIN student_merge m
+        ON s.name_key = m.name_key AND s.class_key = m.class_key AND s.id > m.keep_id
+    """)
+    cursor.execute("DROP TEMPORARY TABLE student_merge")
+    conn.commit()
+
 def init_db():
     conn = mysql.connector.connect(**get_db_config())
     cursor = conn.cursor()
@@ -19,6 +77,7 @@ def init_db():
         id INT AUTO_INCREMENT PRIMARY KEY,
         student_name VARCHAR(100) NOT NULL,
         class_name VARCHAR(50) NOT NULL,
+        student_id INT NULL,
         score INT NOT NULL,
         total_time INT NOT NULL,
         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
@@ -32,6 +91,9 @@ def init_db():
         id INT AUTO_INCREMENT PRIMARY KEY,
         full_name VARCHAR(100) NOT NULL,
         class_name VARCHAR(50) NOT NULL,
+        name_key VARCHAR(100) NOT NULL DEFAULT '',
+        class_key VARCHAR(50) NOT NULL DEFAULT '',
+        login_count INT NOT NULL DEFAULT 1,
         login_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP
     )
     """)
@@ -76,6 +138,137 @@ def init_db():
     """)
     print("Table 'pending_changes' created or checked.")
 
+    # --- Rollups & archive (see rollup.py) ---
+    # Daily summaries so analytics queries don't scan the raw, ever-growing tables
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS daily_student_stats (
+        stat_date DATE NOT NULL,
+        student_name VARCHAR(100) NOT NULL,
+        class_name VARCHAR(50) NOT NULL,
+        attempts INT NOT NULL DEFAULT 0,
+        best_score INT NOT NULL DEFAULT 0,
+        best_time INT NOT NULL DEFAULT 0,
+        total_score BIGINT NOT NULL DEFAULT 0,
+        last_at TIMESTAMP NULL,
+        PRIMARY KEY (stat_date, student_name, class_name)
+    )
+    """)
+    print("Table 'daily_student_stats' created or checked.")
+
+    # All-time best per student, so the leaderboard reads the top rows of an index
+    # instead of grouping every daily row
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS student_best_stats (
+        student_name VARCHAR(100) NOT NULL,
+        class_name VARCHAR(50) NOT NULL,
+        best_score INT NOT NULL DEFAULT 0,
+        best_time INT NOT NULL DEFAULT 0,
+        last_at TIMESTAMP NULL,
+        PRIMARY KEY (student_name, class_name),
+        INDEX idx_student_best_rank (best_score DESC, best_time)
+    )
+    """)
+    # Backfill from days rolled up before this table existed (idempotent)
+    cursor.execute("""
+    INSERT INTO student_best_stats (student_name, class_name, best_score, best_time, last_at)
+    SELECT student_name, class_name, MAX(best_score), MIN(best_time), MAX(last_at)
+    FROM daily_student_stats
+    GROUP BY student_name, class_name
+    ON DUPLICATE KEY UPDATE
+        best_score = GREATEST(best_score, VALUES(best_score)),
+        best_time = LEAST(best_time, VALUES(best_time)),
+        last_at = GREATEST(last_at, VALUES(last_at))
+    """)
+    conn.commit()
+    print("Table 'student_best_stats' created or checked.")
+
+    # Raw rows older than the retention window are moved here
+    cursor.execute("CREATE TABLE IF NOT EXISTS exam_results_archive LIKE exam_results")
+    print("Archive table created or checked.")
+
+    # Watermark: first day that has NOT been rolled up yet
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS rollup_state (
+        name VARCHAR(50) PRIMARY KEY,
+        rolled_until DATE NOT NULL
+    )
+    """)
+    print("Table 'rollup_state' created or checked.")
+
+    # Per-question answer analytics (flushed in batches from analytics.py)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS question_stats (
+        question_id INT PRIMARY KEY,
+        attempts INT NOT NULL DEFAULT 0,
+        correct INT NOT NULL DEFAULT 0,
+        eliminations INT NOT NULL DEFAULT 0,
+        timed_answers INT NOT NULL DEFAULT 0,
+        total_answer_ms BIGINT NOT NULL DEFAULT 0,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+    )
+    """)
+    print("Table 'question_stats' created or checked.")
+
+    # Battle journal: append-only events + latest compact snapshot per room (see battle_journal.py)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS battle_events (
+        id BIGINT AUTO_INCREMENT PRIMARY KEY,
+        room_code VARCHAR(10) NOT NULL,
+        seq INT NOT NULL,
+        event_type VARCHAR(20) NOT NULL,
+        payload_json TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE KEY uq_battle_events_room_seq (room_code, seq)
+    )
+    """)
+    print("Table 'battle_events' created or checked.")
+
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS battle_snapshots (
+        room_code VARCHAR(10) PRIMARY KEY,
+        seq INT NOT NULL,
+        state VARCHAR(20) NOT NULL,
+        snapshot_json MEDIUMTEXT NOT NULL,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+        INDEX idx_battle_snapshots_state (state, updated_at)
+    )
+    """)
+    print("Table 'battle_snapshots' created or checked.")
+    # Sweep of abandoned rooms' events (battle_journal.flush)
+    add_index(cursor, 'battle_events', 'idx_battle_events_created_at', 'created_at')
+
+    # Per-student seen-question sets, serialized by seen_sets.py (a few hundred bytes each)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS student_seen_questions (
+        student_id INT PRIMARY KEY,
+        seen MEDIUMBLOB NOT NULL,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+    )
+    """)
+    print("Table 'student_seen_questions' created or checked.")
+
+    # Time-range indexes used by the rollup job and the "since watermark" queries
+    add_index(cursor, 'exam_results', 'idx_exam_results_created_at', 'created_at')
+    # Student directory: normalized search keys + prefix/keyset indexes
+    add_column(cursor, 'students', 'name_key', "VARCHAR(100) NOT NULL DEFAULT '' AFTER class_name")
+    add_column(cursor, 'students', 'class_key', "VARCHAR(50) NOT NULL DEFAULT '' AFTER name_key")
+    backfill_student_keys(conn, cursor)
+    add_index(cursor, 'students', 'idx_students_name_key', 'name_key, class_key, login_time')
+    add_index(cursor, 'students', 'idx_students_class_key', 'class_key, name_key, login_time')
+    print("Student directory columns/indexes created or checked.")
+
+    # Student identity: one row per normalized (name, class), results reference it
+    add_column(cursor, 'students', 'login_count', "INT NOT NULL DEFAULT 1 AFTER class_key")
+    merge_duplicate_students(conn, cursor)
+    add_index(cursor, 'students', 'uq_students_identity', 'name_key, class_key', unique=True)
+    add_column(cursor, 'exam_results', 'student_id', "INT NULL AFTER class_name")
+    add_column(cursor, 'exam_results_archive', 'student_id', "INT NULL AFTER class_name")
+    add_index(cursor, 'exam_results', 'idx_exam_results_student', 'student_id')
+    print("Student identity migration done.")
+
+    # Keyset pagination of the approval queue
+    add_index(cursor, 'pending_changes', 'idx_pending_changes_status_id', 'status, id')
+
     # Insert a guaranteed Super Admin for testing (if not exists)
     # Replace with your actual email if needed
     cursor.execute("INSERT IGNORE INTO admins (email, role) VALUES ('admin@example.com', 'super_admin')")
@@ -0,0 +1,58 @@
+import os
+import threading
+
+# Live leaderboard channel: viewers subscribe once over Socket.IO and get a top-N snapshot,
+# then a background task pushes diffs. The ranking is recomputed at most once per
+# PUSH_SECONDS window per worker, and only when there are subscribers and something changed
+# (a local dirty flag, or a new exam_results id written by another worker).
+
+ROOM = 'leaderboard'
+TOP_N = int(os.getenv('LEADERBOARD_TOP_N', 10))
+PUSH_SECONDS = float(os.getenv('LEADERBOARD_PUSH_SECONDS', 2))
+
+_subscribers = set() # sids in the 'leaderboard' socket room on this worker
+_state = {'rows': None, 'version': 0, 'dirty': True, 'max_id': None}
+_lock = threading.Lock() # one recompute at a time (first subscribers + the push task)
+
+def subscribe(sid):
+    _subscribers.add(sid)
+
+def unsubscribe(sid):
+    _subscribers.discard(sid)
+
+def has_subscribers():
+    return bool(_subscribers)
+
+def mark_dirty():
+    # Called after a result is saved on this worker
+    _state['dirty'] = True
+
+def compact_row(row):
+    return [row['student_name'], row['class_name'], row['score'], row['total_time']]
+
+def snapshot():
+    return {'version': _state['version'], 'rows': _state['rows'] or []}
+
+def diff(old, new):
+    # Only the ranks whose row changed, plus the new length
+    changed = [[i, row] for i, row in enumerate(new) if i >= len(old) or old[i] != row]
+    return {'size': len(new), 'changed': changed}
+
+def refresh(query_top, read_max_id, force=False):
+    # -> diff payload if the ranking changed, else None.
+    # query_top() returns the ranked rows, read_max_id() the current MAX(exam_results.id).
+    with _lock:
+        max_id = read_max_id()
+        if not force and not _state['dirty'] and _state['rows'] is not None and max_id == _state['max_id']:
+            return None
+        _state['dirty'] = False
+        _state['max_id'] = max_id
+        rows = [compact_row(r) for r in query_top(TOP_N)]
+        old = _state['rows'] or [] # viewers may hold an empty version-0 snapshot
+        _state['rows'] = rows
+        if old == rows:
+            return None
+        _state['version'] += 1
+        payload = diff(old, rows)
+        payload['version'] = _state['version']
+        return payload
@@ -0,0 +1,81 @@
+import os
+import time
+import threading
+
+# In-process cache of the whole question bank (it is small and read on every quiz/battle).
+# Admin writes call invalidate(), which only clears this worker's copy; other workers pick
+# changes up after CACHE_TTL_SECONDS (kept short, the bank is also used for grading).
+
+CACHE_TTL_SECONDS = int(os.getenv('QUESTION_CACHE_TTL', 60))
+
+_bank = None
+_lock = threading.Lock()
+
+def compile_grader(q):
+    # Pre-normalize the answer once so grading is a couple of string compares:
+    # (is_short_answer, answer_key, choice_prefix)
+    answer = q['answer'] or ''
+    if q['type'] == 'tu_luan':
+        return (True, answer.strip().lower(), None)
+    return (False, answer, answer.split('.')[0].strip().upper())
+
+def grade(grader, ans):
+    short_answer, key, prefix = grader
+    ans = ans or ''
+    if short_answer:
+        return ans.strip().lower() == key
+    # Multiple choice: full option text or just its prefix (A, B, C, D)
+    choice_prefix = ans.split('.')[0].strip().upper() if ans else ''
+    return ans == key or choice_prefix == prefix
+
+def build(questions):
+    by_category = {}
+    for q in questions:
+        by_category.setdefault(q['category'], []).append(q)
+    return {
+        'all': questions,
+        'by_id': {q['id']: q for q in questions},
+        'by_category': by_category,
+        'graders': {q['id']: compile_grader(q) for q in questions},
+        'loaded_at': time.time(),
+    }
+
+def grader_for(q):
+    bank = _bank
+    grader = bank['graders'].get(q.get('id')) if bank else None
+    if grader is None or bank['by_id'].get(q.get('id')) is not q:
+        grader = compile_grader(q)
+    return grader
+
+def load(conn):
+    cursor = conn.cursor(dictionary=True)
+    cursor.execute("SELECT * FROM questions ORDER BY id")
+    questions = cursor.fetchall()
+    cursor.close()
+    return build(questions)
+
+def is_fresh(bank):
+    return bank is not None and time.time() - bank['loaded_at'] < CACHE_TTL_SECONDS
+
+def get(get_connection):
+    # Returns the cached bank, reloading it when stale; None if the DB is unreachable
+    global _bank
+    bank = _bank
+    if is_fresh(bank):
+        return bank
+
+    with _lock:
+        if is_fresh(_bank):
+            return _bank  # another thread reloaded it meanwhile
+        conn = get_connection()
+        if not conn:
+            return bank
+        try:
+            _bank = load(conn)
+        finally:
+            conn.close()
+        return _bank
+
+def invalidate():
+    global _bank
+    _bank = None
@@ -0,0 +1,98 @@
+import os
+import time
+import secrets
+import threading
+from array import array
+from collections import OrderedDict
+
+# Server-side quiz sessions: the client gets one question at a time (plus the next one
+# prefetched, without answers) and the server grades and keeps the score.
+# Sessions live in a bounded LRU store with an idle TTL, in the worker that created them
+# (same sticky-session requirement as Socket.IO).
+
+MAX_SESSIONS = int(os.getenv('QUIZ_MAX_SESSIONS', 20000))
+SESSION_TTL_SECONDS = int(os.getenv('QUIZ_SESSION_TTL', 3600))
+
+class QuizSession:
+    # ~200 bytes per session with 20 questions
+    __slots__ = ('question_ids', 'cursor', 'score', 'student', 'started_at', 'asked_at', 'last_seen', 'busy')
+
+    def __init__(self, question_ids, student):
+        self.question_ids = array('I', question_ids)
+        self.cursor = 0
+        self.score = 0
+        self.student = student # (student_id, name, group)
+        self.started_at = self.asked_at = self.last_seen = time.time()
+        self.busy = False # an answer is being graded/saved (see claim)
+
+    @property
+    def finished(self):
+        return self.cursor >= len(self.question_ids)
+
+_sessions = OrderedDict() # session id -> QuizSession, least recently used first
+_lock = threading.Lock()
+
+def create(question_ids, student):
+    session_id = secrets.token_urlsafe(12)
+    quiz = QuizSession(question_ids, student)
+    with _lock:
+        _sessions[session_id] = quiz
+        _evict(quiz.last_seen)
+    return session_id, quiz
+
+def _get_locked(session_id, now):
+    quiz = _sessions.get(session_id)
+    if quiz is None:
+        return None
+    if now - quiz.last_seen > SESSION_TTL_SECONDS:
+        del _sessions[session_id]
+        return None
+    quiz.last_seen = now
+    _sessions.move_to_end(session_id)
+    return quiz
+
+def get(session_id):
+    with _lock:
+        return _get_locked(session_id, time.time())
+
+def claim(session_id, index):
+    # Check the answer index and mark the session busy in one step, so two concurrent
+    # answers for the same question can't both advance it. -> (quiz, error)
+    with _lock:
+        quiz = _get_locked(session_id, time.time())
+        if quiz is None:
+            return None, 'expired'
+        if quiz.finished:
+            return quiz, 'finished'
+        if index != quiz.cursor:
+            return quiz, 'out_of_order'
+        if quiz.busy:
+            return quiz, 'busy'
+        quiz.busy = True
+        return quiz, None
+
+def release(quiz):
+    with _lock:
+        quiz.busy = False
+
+def discard(session_id):
+    with _lock:
+        _sessions.pop(session_id, None)
+
+def _evict(now):
+    # Oldest entries are at the front: drop expired ones and anything over the size bound
+    while _sessions:
+        session_id, quiz = next(iter(_sessions.items()))
+        if len(_sessions) > MAX_SESSIONS or now - quiz.last_seen > SESSION_TTL_SECONDS:
+            del _sessions[session_id]
+        else:
+            break
+
+def count():
+    return len(_sessions)
+
+def public_question(q, index):
+    # Everything the client needs to show a question, never the answer
+    if q is None:
+        return None
+    return {'id': q['id'], 'content': q['content'], 'options': q['options'], 'type': q['type'], 'index': index}
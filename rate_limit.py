@@ -0,0 +1,156 @@
+import os
+import time
+import threading
+from functools import wraps
+from flask import current_app, request, session, jsonify
+from flask_socketio import emit
+import students
+import quiz_sessions
+
+try:
+    import redis # optional shared backend: pip install redis
+except ImportError:
+    redis = None
+
+# Admission control: per-client token buckets for HTTP routes and socket events, plus a
+# global cap on concurrent DB-backed requests. Rejections are cheap (429/503 or a
+# 'rate_limited' socket event) and never reach the DB or a room's game loop.
+#
+# Clients are keyed by something the server issued and can verify (admin session, a live quiz
+# session, a valid student token), else by IP. Behind a reverse proxy set TRUSTED_PROXY_COUNT
+# so the app sees the real client address (ProxyFix in create_app); X-Forwarded-For is never
+# read here, it is trivially spoofed.
+#
+# Buckets live in a plain dict per worker, without a lock: every access is a single dict
+# operation (atomic under the GIL; green threads don't switch between them at all). A take
+# pops and re-inserts its key, so insertion order is recency order and the first key is
+# evicted past MAX_KEYS: memory and per-request work stay bounded. A race can at worst
+# let one extra request through.
+# With RATE_LIMIT_REDIS_URL set (and redis installed) buckets are shared across workers.
+
+ENABLED = os.getenv('RATE_LIMIT_ENABLED', '1') == '1'
+DB_MAX_CONCURRENCY = int(os.getenv('DB_MAX_CONCURRENCY', 32))
+MAX_KEYS = 50000 # least recently used buckets are evicted beyond this
+
+# name -> (tokens per second, burst) for clients with a verified identity, and socket sids
+LIMITS = {
+    'categories': (5, 60),
+    'login': (2, 60),
+    'questions': (2, 30),
+    'quiz_start': (0.2, 5),
+    'quiz_answer': (2, 5),
+    'leaderboard': (1, 30),
+    # socket events, per sid
+    'create_room': (0.2, 3),
+    'join_room': (0.5, 5),
+    'resume_session': (0.5, 5),
+    'start_game': (0.2, 3),
+    'submit_answer': (2, 5),
+    'round_timeout': (1, 3),
+    'next_question': (1, 3),
+    'subscribe_leaderboard': (0.5, 5),
+}
+
+# IP-keyed budgets are NAT-sized: a whole school can share one address, and login, the
+# GET routes and tokenless clients are always keyed by IP (e.g. the morning login rush)
+IP_LIMITS = {
+    'categories': (20, 600),
+    'login': (10, 300),
+    'questions': (10, 300),
+    'quiz_start': (5, 200),
+    'leaderboard': (5, 200),
+}
+
+_buckets = {} # key -> (tokens, last refill time), least recently used first
+_db_slots = threading.BoundedSemaphore(DB_MAX_CONCURRENCY)
+
+_redis = None
+if redis and os.getenv('RATE_LIMIT_REDIS_URL'):
+    _redis = redis.Redis.from_url(os.getenv('RATE_LIMIT_REDIS_URL'), socket_timeout=0.05)
+    # KEYS[1] = bucket, ARGV = rate, burst, now -> 1 if allowed
+    _take = _redis.register_script("""
+        local b = redis.call('HMGET', KEYS[1], 't', 'ts')
+        local rate, burst, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+        local tokens = tonumber(b[1]) or burst
+        local ts = tonumber(b[2]) or now
+        tokens = math.min(burst, tokens + (now - ts) * rate)
+        local ok = 0
+        if tokens >= 1 then tokens = tokens - 1; ok = 1 end
+        redis.call('HSET', KEYS[1], 't', tokens, 'ts', now)
+        redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+        return ok
+    """)
+
+def _take_local(key, rate, burst):
+    now = time.monotonic()
+    # pop + re-insert moves the key to the most recently used end
+    tokens, last = _buckets.pop(key, (burst, now))
+    tokens = min(burst, tokens + (now - last) * rate)
+    allowed = tokens >= 1
+    _buckets[key] = (tokens - 1 if allowed else tokens, now)
+    if len(_buckets) > MAX_KEYS:
+        try:
+            _buckets.pop(next(iter(_buckets)), None) # least recently used
+        except (StopIteration, RuntimeError):
+            pass # emptied/resized by a concurrent take
+    return allowed
+
+def allow(name, client, by_ip=False):
+    if not ENABLED:
+        return True
+    rate, burst = IP_LIMITS.get(name, LIMITS[name]) if by_ip else LIMITS[name]
+    key = f'{name}:{client}'
+    if _redis is not None:
+        try:
+            return bool(_take(keys=['rl:' + key], args=[rate, burst, time.time()]))
+        except redis.RedisError:
+            pass # shared backend down: fall back to this worker's buckets
+    return _take_local(key, rate, burst)
+
+def client_key():
+    # -> (key, by_ip). Most specific verified identity: admin, live quiz session, valid
+    # student token; anything else (unknown ids, forged tokens) falls back to the IP
+    if 'admin_id' in session:
+        return f"admin:{session['admin_id']}", False
+    data = request.get_json(silent=True) if request.is_json else None
+    if isinstance(data, dict):
+        if isinstance(data.get('session_id'), str) and quiz_sessions.get(data['session_id']) is not None:
+            return f"quiz:{data['session_id']}", False
+        identity = students.read_token(current_app.secret_key, data.get('token'))
+        if identity:
+            return f"student:{identity['id']}", False
+    return request.remote_addr, True
+
+def limit(name):
+    def decorator(f):
+        @wraps(f)
+        def wrapped(*args, **kwargs):
+            if not allow(name, *client_key()):
+                return jsonify({'error': 'Too many requests'}), 429, {'Retry-After': '1'}
+            return f(*args, **kwargs)
+        return wrapped
+    return decorator
+
+def db_admission(f):
+    # Global cap on in-flight DB-backed requests; excess load is shed instead of queued
+    @wraps(f)
+    def wrapped(*args, **kwargs):
+        if ENABLED and not _db_slots.acquire(blocking=False):
+            return jsonify({'error': 'Server busy'}), 503, {'Retry-After': '1'}
+        try:
+            return f(*args, **kwargs)
+        finally:
+            if ENABLED:
+                _db_slots.release()
+    return wrapped
+
+def limit_event(name):
+    def decorator(f):
+        @wraps(f)
+        def wrapped(*args, **kwargs):
+            if not allow(name, request.sid):
+                emit('rate_limited', {'event': name})
+                return
+            return f(*args, **kwargs)
+        return wrapped
+    return decorator
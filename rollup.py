@@ -0,0 +1,112 @@
+import os
+import datetime
+import mysql.connector
+
+# Background rollup + archival for the append-only exam_results table.
+#   1. Fold every completed day into the all-time student_best_stats (what the leaderboard reads)
+#      (daily_student_stats is no longer written; it only seeds student_best_stats in init_db)
+#   2. Move raw rows older than the retention window into exam_results_archive
+# (students holds one row per real student since the identity model, so it is not archived.)
+# Analytics queries read the rollups + the small "since watermark" tail of the hot tables.
+
+RETENTION_DAYS = int(os.getenv('ROLLUP_RETENTION_DAYS', 30))
+ARCHIVE_BATCH_SIZE = int(os.getenv('ROLLUP_ARCHIVE_BATCH', 5000))
+LOCK_NAME = 'rung_chuong_vang_rollup'
+EPOCH = datetime.date(1970, 1, 1)
+
+# Columns copied into the archive tables (explicit so schema additions don't break INSERT ... SELECT)
+ARCHIVE_TABLES = {
+    'exam_results': ('created_at', 'id, student_name, class_name, student_id, score, total_time, created_at'),
+}
+
+def get_watermark(cursor):
+    # First day that is NOT covered by the rollup tables yet
+    cursor.execute("SELECT rolled_until FROM rollup_state WHERE name = 'daily'")
+    row = cursor.fetchone()
+    if not row:
+        return EPOCH
+    return row['rolled_until'] if isinstance(row, dict) else row[0]
+
+def rollup_days(cursor, start, end):
+    # Full days [start, end); GREATEST/LEAST keep this idempotent when a range is rolled up again
+    cursor.execute("""
+        INSERT INTO student_best_stats (student_name, class_name, best_score, best_time, last_at)
+        SELECT student_name, class_name, MAX(score), MIN(total_time), MAX(created_at)
+        FROM exam_results
+        WHERE created_at >= %s AND created_at < %s
+        GROUP BY student_name, class_name
+        ON DUPLICATE KEY UPDATE
+            best_score = GREATEST(best_score, VALUES(best_score)),
+            best_time = LEAST(best_time, VALUES(best_time)),
+            last_at = GREATEST(last_at, VALUES(last_at))
+    """, (start, end))
+
+    cursor.execute("""
+        INSERT INTO rollup_state (name, rolled_until) VALUES ('daily', %s)
+        ON DUPLICATE KEY UPDATE rolled_until = VALUES(rolled_until)
+    """, (end,))
+
+def archive_table(conn, cursor, table, cutoff):
+    # Move rows older than cutoff in small id-ordered batches to keep locks short
+    time_col, columns = ARCHIVE_TABLES[table]
+    moved = 0
+    while True:
+        cursor.execute(
+            f"SELECT MAX(id) FROM (SELECT id FROM {table} WHERE {time_col} < %s ORDER BY id LIMIT %s) batch",
+            (cutoff, ARCHIVE_BATCH_SIZE)
+        )
+        row = cursor.fetchone()
+        max_id = row[0] if row else None
+        if max_id is None:
+            break
+
+        cursor.execute(
+            f"INSERT IGNORE INTO {table}_archive ({columns}) "
+            f"SELECT {columns} FROM {table} WHERE id <= %s AND {time_col} < %s",
+            (max_id, cutoff)
+        )
+        cursor.execute(f"DELETE FROM {table} WHERE id <= %s AND {time_col} < %s", (max_id, cutoff))
+        moved += cursor.rowcount
+        conn.commit()
+    return moved
+
+def run_rollup(conn, today=None):
+    cursor = conn.cursor()
+
+    # Only one worker/process runs the job at a time
+    cursor.execute("SELECT GET_LOCK(%s, 0)", (LOCK_NAME,))
+    if cursor.fetchone()[0] != 1:
+        cursor.close()
+        return None
+
+    try:
+        if today is None:
+            # The DB's date, not the app's: day boundaries must match DATE(created_at)
+            cursor.execute("SELECT CURDATE()")
+            today = cursor.fetchone()[0]
+        start = get_watermark(cursor)
+        if start == EPOCH:
+            cursor.execute("SELECT DATE(MIN(created_at)) FROM exam_results")
+            start = cursor.fetchone()[0] or today
+
+        if start < today:
+            rollup_days(cursor, start, today)
+            conn.commit()
+
+        # Never archive rows the rollup hasn't seen yet
+        cutoff = min(get_watermark(cursor), today - datetime.timedelta(days=RETENTION_DAYS))
+        moved = {table: archive_table(conn, cursor, table, cutoff) for table in ARCHIVE_TABLES}
+        return {'rolled_until': str(get_watermark(cursor)), 'archived': moved}
+    finally:
+        cursor.execute("SELECT RELEASE_LOCK(%s)", (LOCK_NAME,))
+        cursor.fetchone()
+        cursor.close()
+
+if __name__ == '__main__':
+    # Manual run: python rollup.py
+    from init_db import get_db_config
+    conn = mysql.connector.connect(**get_db_config())
+    try:
+        print(run_rollup(conn))
+    finally:
+        conn.close()
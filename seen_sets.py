@@ -0,0 +1,293 @@
+import os
+import random
+import struct
+import time
+import threading
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+
+# Per-student "already seen" question sets, so samplers can prefer unseen questions.
+# Roaring-style: ids are split into 16-bit chunks, each chunk is a sorted uint16 array
+# while small and switches to an 8 KB bitmap when dense. A student who has seen a few
+# hundred questions costs a few hundred bytes, even with a 50k-question bank.
+# Sets are cached per worker (LRU) and changes are merged into compact BLOBs in batches.
+
+ARRAY_MAX = 4096 # beyond this many ids in one chunk a bitmap is smaller
+CACHE_SIZE = int(os.getenv('SEEN_CACHE_SIZE', 20000))
+
+class SeenSet:
+    __slots__ = ('chunks',)
+
+    def __init__(self):
+        self.chunks = {} # high 16 bits -> array('H') (sorted) or bytearray(8192)
+
+    def __contains__(self, qid):
+        chunk = self.chunks.get(qid >> 16)
+        if chunk is None:
+            return False
+        low = qid & 0xFFFF
+        if isinstance(chunk, bytearray):
+            return bool(chunk[low >> 3] & (1 << (low & 7)))
+        i = bisect_left(chunk, low)
+        return i < len(chunk) and chunk[i] == low
+
+    def __len__(self):
+        return sum(
+            sum(bin(b).count('1') for b in c) if isinstance(c, bytearray) else len(c)
+            for c in self.chunks.values()
+        )
+
+    def __iter__(self):
+        for high in sorted(self.chunks):
+            chunk = self.chunks[high]
+            base = high << 16
+            if isinstance(chunk, bytearray):
+                for i, byte in enumerate(chunk):
+                    if byte:
+                        for bit in range(8):
+                            if byte & (1 << bit):
+                                yield base | (i << 3) | bit
+            else:
+                for low in chunk:
+                    yield base | low
+
+    def add(self, qid):
+        high, low = qid >> 16, qid & 0xFFFF
+        chunk = self.chunks.get(high)
+        if chunk is None:
+            self.chunks[high] = array('H', [low])
+            return True
+        if isinstance(chunk, bytearray):
+            bit = 1 << (low & 7)
+            if chunk[low >> 3] & bit:
+                return False
+            chunk[low >> 3] |= bit
+            return True
+        i = bisect_left(chunk, low)
+        if i < len(chunk) and chunk[i] == low:
+            return False
+        chunk.insert(i, low)
+        if len(chunk) > ARRAY_MAX:
+            bitmap = bytearray(8192)
+            for v in chunk:
+                bitmap[v >> 3] |= 1 << (v & 7)
+            self.chunks[high] = bitmap
+        return True
+
+    def discard(self, qid):
+        high, low = qid >> 16, qid & 0xFFFF
+        chunk = self.chunks.get(high)
+        if chunk is None:
+            return
+        if isinstance(chunk, bytearray):
+            chunk[low >> 3] &= ~(1 << (low & 7)) & 0xFF
+            return
+        i = bisect_left(chunk, low)
+        if i < len(chunk) and chunk[i] == low:
+            del chunk[i]
+            if not chunk:
+                del self.chunks[high]
+
+    def to_bytes(self):
+        # Per chunk: high (H), kind (B: 0 array / 1 bitmap), count (H), payload
+        out = bytearray()
+        for high in sorted(self.chunks):
+            chunk = self.chunks[high]
+            if isinstance(chunk, bytearray):
+                out += struct.pack('<HBH', high, 1, 0) + chunk
+            else:
+                out += struct.pack('<HBH', high, 0, len(chunk)) + chunk.tobytes()
+        return bytes(out)
+
+    @classmethod
+    def from_bytes(cls, data):
+        seen = cls()
+        pos = 0
+        while pos + 5 <= len(data):
+            high, kind, count = struct.unpack_from('<HBH', data, pos)
+            pos += 5
+            if kind == 1:
+                seen.chunks[high] = bytearray(data[pos:pos + 8192])
+                pos += 8192
+            else:
+                chunk = array('H')
+                chunk.frombytes(data[pos:pos + 2 * count])
+                seen.chunks[high] = chunk
+                pos += 2 * count
+        return seen
+
+def sample_unseen(pool, limit, is_seen):
+    # Unseen questions first; when the pool runs out, top up from seen ones.
+    # Returns (picked, exhausted) - exhausted means the caller should start a new cycle.
+    unseen = [q for q in pool if not is_seen(q['id'])]
+    if len(unseen) >= limit:
+        return random.sample(unseen, limit), False
+    seen = [q for q in pool if is_seen(q['id'])]
+    fill = random.sample(seen, min(limit - len(unseen), len(seen)))
+    picked = unseen + fill
+    random.shuffle(picked)
+    return picked, True
+
+# --- Per-worker cache + batched persistence ---
+# Workers never write back their whole cached set: changes are kept as per-student deltas
+# (added / removed ids) and flush() merges them into the stored set under a row lock, so
+# marks from several workers all survive. Cached sets are refreshed from the merged result
+# on flush and reloaded after CACHE_TTL_SECONDS otherwise.
+
+CACHE_TTL_SECONDS = int(os.getenv('SEEN_CACHE_TTL', 300))
+
+_cache = OrderedDict() # student_id -> (SeenSet, loaded at), least recently used first
+_deltas = {}           # student_id -> (added SeenSet, removed SeenSet) not yet flushed
+_lock = threading.Lock()
+
+def _load(conn_factory, student_ids):
+    # -> {student_id: SeenSet} for the rows found, or None if the DB can't be read
+    conn = conn_factory()
+    if not conn:
+        return None
+    try:
+        cursor = conn.cursor()
+        placeholders = ', '.join(['%s'] * len(student_ids))
+        cursor.execute(f"SELECT student_id, seen FROM student_seen_questions WHERE student_id IN ({placeholders})", student_ids)
+        loaded = {row[0]: SeenSet.from_bytes(bytes(row[1])) for row in cursor.fetchall()}
+        cursor.close()
+        return loaded
+    except Exception as err:
+        print(f"Error: {err}")
+        return None
+    finally:
+        conn.close()
+
+def get_many(conn_factory, student_ids):
+    # Cached sets, loading all misses (e.g. a whole battle roster) in one query.
+    # If the DB can't be read the missing students get a temporary empty set that is not
+    # cached, so nothing is marked or persisted for them (sampling is then plain random).
+    now = time.time()
+    found, missing = {}, []
+    with _lock:
+        for student_id in student_ids:
+            entry = _cache.get(student_id)
+            if entry is None or (now - entry[1] > CACHE_TTL_SECONDS and student_id not in _deltas):
+                missing.append(student_id)
+            else:
+                _cache.move_to_end(student_id)
+                found[student_id] = entry[0]
+
+    if missing:
+        loaded = _load(conn_factory, missing)
+        if loaded is None:
+            for student_id in missing:
+                found[student_id] = SeenSet()
+        else:
+            with _lock:
+                for student_id in missing:
+                    seen = loaded.get(student_id) or SeenSet()
+                    _apply(seen, _deltas.get(student_id))
+                    _cache[student_id] = (seen, now)
+                    _cache.move_to_end(student_id)
+                    found[student_id] = seen
+                # Evict from the cold end; a set with unflushed changes stops eviction until the next flush
+                while len(_cache) > CACHE_SIZE:
+                    old_id = next(iter(_cache))
+                    if old_id in _deltas:
+                        break
+                    del _cache[old_id]
+    return [found[student_id] for student_id in student_ids]
+
+def _apply(seen, delta):
+    if delta:
+        added, removed = delta
+        for qid in removed:
+            seen.discard(qid)
+        for qid in added:
+            seen.add(qid)
+
+def _delta(student_id):
+    delta = _deltas.get(student_id)
+    if delta is None:
+        delta = _deltas[student_id] = (SeenSet(), SeenSet())
+    return delta
+
+def mark(student_id, question_ids):
+    with _lock:
+        entry = _cache.get(student_id)
+        if entry is None:
+            return # not loaded (or the load failed): nothing to persist
+        added, removed = _delta(student_id)
+        for qid in question_ids:
+            entry[0].add(qid)
+            added.add(qid)
+            removed.discard(qid)
+
+def start_new_cycle(student_id, question_ids):
+    # Pool exhausted: forget these questions so the next sets are fresh again
+    with _lock:
+        entry = _cache.get(student_id)
+        if entry is None:
+            return
+        added, removed = _delta(student_id)
+        for qid in question_ids:
+            entry[0].discard(qid)
+            removed.add(qid)
+            added.discard(qid)
+
+def _merge_back(batch):
+    # Flush failed: put the deltas back, older first so newer changes win
+    with _lock:
+        for student_id, (added, removed) in batch.items():
+            newer = _deltas.get(student_id)
+            if newer:
+                _combine(added, removed, newer)
+            _deltas[student_id] = (added, removed)
+
+def _combine(added, removed, newer):
+    new_added, new_removed = newer
+    for qid in new_removed:
+        added.discard(qid)
+        removed.add(qid)
+    for qid in new_added:
+        removed.discard(qid)
+        added.add(qid)
+
+def flush(conn):
+    global _deltas
+    with _lock:
+        batch, _deltas = _deltas, {}
+    if not batch:
+        return 0
+
+    ids = sorted(batch)
+    cursor = conn.cursor()
+    try:
+        conn.start_transaction()
+        placeholders = ', '.join(['%s'] * len(ids))
+        # Lock the stored rows so concurrent flushes from other workers merge one after another
+        cursor.execute(f"SELECT student_id, seen FROM student_seen_questions WHERE student_id IN ({placeholders}) FOR UPDATE", ids)
+        stored = {row[0]: SeenSet.from_bytes(bytes(row[1])) for row in cursor.fetchall()}
+        merged = {}
+        for student_id in ids:
+            seen = stored.get(student_id) or SeenSet()
+            _apply(seen, batch[student_id])
+            merged[student_id] = seen
+        cursor.executemany("""
+            INSERT INTO student_seen_questions (student_id, seen) VALUES (%s, %s)
+            ON DUPLICATE KEY UPDATE seen = VALUES(seen)
+        """, [(student_id, merged[student_id].to_bytes()) for student_id in ids])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        _merge_back(batch)
+        raise
+    finally:
+        cursor.close()
+
+    # Refresh cached sets with the merged result (picks up other workers' marks),
+    # replaying changes made since the batch was taken
+    now = time.time()
+    with _lock:
+        for student_id, seen in merged.items():
+            if student_id in _cache:
+                _apply(seen, _deltas.get(student_id))
+                _cache[student_id] = (seen, now)
+    return len(ids)
@@ -0,0 +1,102 @@
+import os
+import re
+import gzip
+import hashlib
+from flask import Response, request, render_template
+
+try:
+    import brotli # optional: pip install Brotli
+except ImportError:
+    brotli = None
+
+# Static page pipeline: the student-facing pages don't depend on request data, so they are
+# rendered once at startup. Inline <script>/<style> blocks are moved into fingerprinted
+# /assets/ files (cacheable forever), and every body is kept in memory pre-compressed
+# (gzip, and brotli when available) with an ETag.
+
+ENABLED = os.getenv('STATIC_PAGES_ENABLED', '1') == '1'
+
+PAGES = ['index.html', 'dashboard.html', 'quiz.html', 'leaderboard.html', 'battle_app.html', 'admin_login.html']
+# Pages that depend on a small, known set of context values
+PAGE_VARIANTS = {'admin_dashboard.html': [{'role': 'editor'}, {'role': 'super_admin'}]}
+
+PAGE_CACHE_CONTROL = 'no-cache' # always revalidate (cheap 304 via ETag), a deploy changes the page
+ASSET_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+# Scripts first: dashboard.html has a <style> inside a JS template string
+INLINE_SCRIPT = re.compile(r'<script>(.*?)</script>', re.S)
+INLINE_STYLE = re.compile(r'<style>(.*?)</style>', re.S)
+
+_pages = {}  # (template, variant key) -> entry
+_assets = {} # fingerprinted file name -> entry
+
+def make_entry(body, content_type):
+    body = body.encode('utf-8') if isinstance(body, str) else body
+    bodies = {'identity': body, 'gzip': gzip.compress(body, compresslevel=9, mtime=0)}
+    if brotli:
+        bodies['br'] = brotli.compress(body)
+    return {
+        'etag': '"%s"' % hashlib.sha1(body).hexdigest()[:20],
+        'content_type': content_type,
+        'bodies': bodies,
+    }
+
+def add_asset(content, ext, content_type):
+    content = content.strip() + '\n'
+    name = '%s.%s' % (hashlib.sha1(content.encode('utf-8')).hexdigest()[:16], ext)
+    if name not in _assets:
+        _assets[name] = make_entry(content, content_type)
+    return '/assets/' + name
+
+def extract_assets(html):
+    html = INLINE_SCRIPT.sub(
+        lambda m: '<script src="%s"></script>' % add_asset(m.group(1), 'js', 'application/javascript; charset=utf-8'),
+        html
+    )
+    return INLINE_STYLE.sub(
+        lambda m: '<link rel="stylesheet" href="%s">' % add_asset(m.group(1), 'css', 'text/css; charset=utf-8'),
+        html
+    )
+
+def variant_key(context):
+    return tuple(sorted(context.items()))
+
+def build(app):
+    if not ENABLED:
+        return 0
+    with app.test_request_context():
+        for name in PAGES:
+            _pages[(name, ())] = make_entry(extract_assets(render_template(name)), 'text/html; charset=utf-8')
+        for name, variants in PAGE_VARIANTS.items():
+            for context in variants:
+                html = extract_assets(render_template(name, **context))
+                _pages[(name, variant_key(context))] = make_entry(html, 'text/html; charset=utf-8')
+    return len(_pages)
+
+def respond(entry, cache_control):
+    headers = {'ETag': entry['etag'], 'Cache-Control': cache_control, 'Vary': 'Accept-Encoding'}
+    if entry['etag'] in request.headers.get('If-None-Match', ''):
+        return Response(status=304, headers=headers)
+
+    accepted = request.headers.get('Accept-Encoding', '')
+    encoding = 'identity'
+    if 'br' in entry['bodies'] and 'br' in accepted:
+        encoding = 'br'
+    elif 'gzip' in accepted:
+        encoding = 'gzip'
+    if encoding != 'identity':
+        headers['Content-Encoding'] = encoding
+    return Response(entry['bodies'][encoding], content_type=entry['content_type'], headers=headers)
+
+def serve(name, **context):
+    # Pre-rendered page, or a normal render if the pipeline is off / the variant is unknown
+    entry = _pages.get((name, variant_key(context)))
+    if entry is None:
+        return render_template(name, **context)
+    return respond(entry, PAGE_CACHE_CONTROL)
+
+def serve_asset(name):
+    entry = _assets.get(name)
+    if entry is None:
+        return None
+    return respond(entry, ASSET_CACHE_CONTROL)
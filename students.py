@@ -0,0 +1,170 @@
+import os
+import re
+import json
+import time
+import base64
+import threading
+import unicodedata
+from collections import OrderedDict
+from itsdangerous import URLSafeTimedSerializer, BadSignature
+
+# Student identity + directory helpers.
+# A student is one row per normalized (name, class); login returns a signed session
+# token and repeat logins are answered from an in-process identity cache. Their
+# login_count/login_time updates are counted in memory and flushed in batches.
+
+IDENTITY_CACHE_SIZE = int(os.getenv('IDENTITY_CACHE_SIZE', 20000))
+# Deletes only clear the deleting worker's cache; other workers drop the entry after this
+IDENTITY_CACHE_TTL_SECONDS = int(os.getenv('IDENTITY_CACHE_TTL', 300))
+TOKEN_MAX_AGE_SECONDS = int(os.getenv('STUDENT_TOKEN_MAX_AGE', 30 * 24 * 3600))
+TOKEN_SALT = 'student-session'
+
+_identities = OrderedDict() # (name_key, class_key) -> ((student id, full_name, class_name), cached at), LRU order
+_identities_lock = threading.Lock()
+
+_logins = {} # student id -> [repeat logins not yet written, last login unix time]
+_logins_lock = threading.Lock()
+
+def normalize_key(text):
+    # "Nguyễn Văn Đạt " -> "nguyen van dat" (đ is a separate letter, not a combining mark)
+    text = (text or '').replace('đ', 'd').replace('Đ', 'D')
+    text = unicodedata.normalize('NFD', text)
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch))
+    return re.sub(r'\s+', ' ', text).strip().lower()
+
+def like_prefix(text):
+    key = normalize_key(text)
+    return key.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values, ensure_ascii=False).encode()).decode()
+
+def decode_cursor(cursor):
+    if not cursor:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+    except (ValueError, TypeError):
+        return None
+    # Both values are (name_key, class_key) strings; anything else is a forged cursor
+    if isinstance(values, list) and len(values) == 2 and all(isinstance(v, str) for v in values):
+        return values
+    return None
+
+def cached_identity(name_key, class_key):
+    # -> (student id, stored full_name, stored class_name) or None
+    key = (name_key, class_key)
+    with _identities_lock:
+        entry = _identities.get(key)
+        if entry is None:
+            return None
+        if time.time() - entry[1] > IDENTITY_CACHE_TTL_SECONDS:
+            del _identities[key]
+            return None
+        _identities.move_to_end(key)
+        return entry[0]
+
+def cache_identity(name_key, class_key, identity):
+    with _identities_lock:
+        _identities[(name_key, class_key)] = (identity, time.time())
+        _identities.move_to_end((name_key, class_key))
+        while len(_identities) > IDENTITY_CACHE_SIZE:
+            _identities.popitem(last=False)
+
+def forget_identity(*student_ids):
+    with _identities_lock:
+        for key in [k for k, v in _identities.items() if v[0][0] in student_ids]:
+            del _identities[key]
+
+def record_login(student_id):
+    # Repeat login served from the cache: counted here, written by flush_logins()
+    with _logins_lock:
+        c = _logins.get(student_id)
+        if c is None:
+            c = _logins[student_id] = [0, 0]
+        c[0] += 1
+        c[1] = time.time()
+
+def flush_logins(conn):
+    global _logins
+    with _logins_lock:
+        batch, _logins = _logins, {}
+    if not batch:
+        return 0
+
+    cursor = conn.cursor()
+    try:
+        cursor.executemany(
+            "UPDATE students SET login_count = login_count + %s, login_time = FROM_UNIXTIME(%s) WHERE id = %s",
+            [(count, int(last), student_id) for student_id, (count, last) in batch.items()]
+        )
+        conn.commit()
+        # Students deleted by another worker: stop handing out their cached id
+        ids = list(batch)
+        cursor.execute(f"SELECT id FROM students WHERE id IN ({', '.join(['%s'] * len(ids))})", ids)
+        existing = {row[0] for row in cursor.fetchall()}
+        forget_identity(*(i for i in ids if i not in existing))
+    except Exception:
+        # Keep the counts for the next flush
+        with _logins_lock:
+            for student_id, (count, last) in batch.items():
+                c = _logins.setdefault(student_id, [0, 0])
+                c[0] += count
+                c[1] = max(c[1], last)
+        raise
+    finally:
+        cursor.close()
+    return len(batch)
+
+def upsert_student(cursor, name, group):
+    # One row per (name_key, class_key); LAST_INSERT_ID(id) makes lastrowid the existing id on duplicates.
+    # -> (id, full_name, class_name) as stored: results and the leaderboard group by that text,
+    # so a repeat login typed with other accents/case must keep the first spelling.
+    cursor.execute("""
+        INSERT INTO students (full_name, class_name, name_key, class_key) VALUES (%s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE id = LAST_INSERT_ID(id), login_count = login_count + 1, login_time = CURRENT_TIMESTAMP
+    """, (name, group, normalize_key(name), normalize_key(group)))
+    student_id = cursor.lastrowid
+    cursor.execute("SELECT full_name, class_name FROM students WHERE id = %s", (student_id,))
+    full_name, class_name = cursor.fetchone()
+    return student_id, full_name, class_name
+
+def make_token(secret_key, student_id, name, group):
+    return URLSafeTimedSerializer(secret_key, salt=TOKEN_SALT).dumps({'id': student_id, 'name': name, 'group': group})
+
+def read_token(secret_key, token):
+    # -> {'id', 'name', 'group'} or None if missing/forged/expired
+    if not token:
+        return None
+    try:
+        return URLSafeTimedSerializer(secret_key, salt=TOKEN_SALT).loads(token, max_age=TOKEN_MAX_AGE_SECONDS)
+    except BadSignature:
+        return None
+
+def directory_query(name=None, class_name=None, after=None, limit=50):
+    # One row per student (name_key, class_key) with login counts (GROUP BY also folds legacy duplicate rows).
+    # Ordered to match an index so MySQL streams groups and stops at LIMIT:
+    #   name search (or no filter) -> (name_key, class_key)
+    #   class-only search          -> (class_key, name_key)
+    order = ['class_key', 'name_key'] if class_name and not name else ['name_key', 'class_key']
+    where, params = [], []
+    if name:
+        where.append("name_key LIKE %s")
+        params.append(like_prefix(name))
+    if class_name:
+        where.append("class_key LIKE %s")
+        params.append(like_prefix(class_name))
+    if after:
+        where.append(f"({order[0]}, {order[1]}) > (%s, %s)")
+        params += after
+
+    sql = """
+        SELECT name_key, class_key, MAX(full_name) as full_name, MAX(class_name) as class_name,
+               SUM(login_count) as login_count, MAX(login_time) as last_login, MAX(id) as id
+        FROM students
+    """
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += f" GROUP BY {order[0]}, {order[1]} ORDER BY {order[0]}, {order[1]} LIMIT %s"
+    params.append(limit)
+    return sql, params, order